@@ -11,16 +11,19 @@ except ImportError:
         pass
 
 try:
-    from pymongo.errors import BulkWriteError
+    from pymongo.errors import OperationFailure
 except ImportError:
-    class BulkWriteError(PyMongoError):
+    class OperationFailure(PyMongoError):
         pass
 
 try:
-    from pymongo.errors import OperationFailure
+    from pymongo.errors import BulkWriteError
 except ImportError:
-    class OperationFailure(PyMongoError):
-        pass
+    class BulkWriteError(OperationFailure):
+        def __init__(self, results):
+            super(BulkWriteError, self).__init__('batch op errors occurred')
+            self.code = 65
+            self.details = results
 
 try:
     from pymongo.errors import CollectionInvalid
@@ -58,6 +61,12 @@ except ImportError:
     class WriteError(OperationFailure):
         pass
 
+try:
+    from bson.errors import InvalidDocument
+except ImportError:
+    class InvalidDocument(PyMongoError):
+        pass
+
 from .helpers import ObjectId  # noqa
 from mongomock.__version__ import __version__
 
@@ -4,10 +4,11 @@ from collections import OrderedDict
 import copy
 from datetime import datetime
 import functools
+import heapq
 import itertools
 import json
 import math
-import threading
+import numbers
 import time
 import warnings
 
@@ -28,8 +29,8 @@ except ImportError:
         AFTER = True
 
 from sentinels import NOTHING
+from six import integer_types
 from six import iteritems
-from six import iterkeys
 from six import itervalues
 from six import MAXSIZE
 from six import string_types
@@ -37,11 +38,17 @@ from six import text_type
 
 
 from mongomock.command_cursor import CommandCursor
+from mongomock.command_cursor import DEFAULT_BATCH_SIZE
 from mongomock import DuplicateKeyError, BulkWriteError
+from mongomock.filtering import compile_filter
 from mongomock.filtering import filter_applies
 from mongomock.filtering import iter_key_candidates
+from mongomock.filtering import LOGICAL_OPERATOR_MAP
+from mongomock import frozen
 from mongomock import helpers
+from mongomock import indexes
 from mongomock import InvalidOperation
+from mongomock.locking import RWLock
 from mongomock import ObjectId
 from mongomock import OperationFailure
 from mongomock.results import BulkWriteResult
@@ -52,7 +59,9 @@ from mongomock.results import UpdateResult
 from mongomock.write_concern import WriteConcern
 from mongomock import WriteError
 
-lock = threading.RLock()
+
+# Number of documents that scans filter at once while holding the lock.
+_SCAN_CHUNK_SIZE = 64
 
 
 def validate_is_mapping(option, value):
@@ -275,7 +284,19 @@ class Collection(object):
         self.full_name = "{0}.{1}".format(db.name, name)
         self.database = db
         self._documents = OrderedDict()
-        self._uniques = []
+        self._indexes = OrderedDict()
+        # insertion rank of each document, to return index lookups in natural order
+        self._sequence_numbers = {}
+        self._sequence_counter = itertools.count()
+        # (sequence number, id) of the documents in insertion order, only
+        # ever appended to, so that scans can read it while it grows
+        self._natural_order = []
+        self._removed_from_natural_order = 0
+        # store immutable documents and hand out copy-on-write views of them
+        self._frozen_documents = db.client.frozen_documents
+        self._validate_bson = db.client.validate_bson
+        # readers share it to look up and read documents, writers take it alone
+        self._lock = RWLock()
 
     def __repr__(self):
         return "Collection({0}, '{1}')".format(self.database, self.name)
@@ -306,41 +327,114 @@ class Collection(object):
     def insert_many(self, documents, ordered=True):
         if not isinstance(documents, collections.Iterable) or not documents:
             raise TypeError('documents must be a non-empty list')
+        documents = list(documents)
         for document in documents:
             validate_is_mutable_mapping('document', document)
-        try:
-            return InsertManyResult(self._insert(documents), acknowledged=True)
-        except DuplicateKeyError:
-            raise BulkWriteError('batch op errors occurred')
+        inserted_ids, write_errors = self._insert_documents(documents, ordered)
+        if write_errors:
+            if ordered:
+                n_inserted = write_errors[0]['index']
+            else:
+                n_inserted = len(documents) - len(write_errors)
+            raise BulkWriteError({
+                'writeErrors': write_errors,
+                'writeConcernErrors': [],
+                'nInserted': n_inserted,
+                'nUpserted': 0,
+                'nMatched': 0,
+                'nModified': 0,
+                'nRemoved': 0,
+                'upserted': [],
+            })
+        return InsertManyResult(inserted_ids, acknowledged=True)
 
     def _insert(self, data):
         if isinstance(data, list):
-            return [self._insert(item) for item in data]
+            inserted_ids, write_errors = self._insert_documents(data, ordered=True)
+            if write_errors:
+                raise DuplicateKeyError("Duplicate Key Error", 11000)
+            return inserted_ids
+
+        object_id = self._prepare_for_insert(data)
+        with self._lock.writer:
+            if self._find_duplicate_key(object_id, data):
+                raise DuplicateKeyError("Duplicate Key Error", 11000)
+            self._store_document(object_id, data)
+        return data['_id']
+
+    def _insert_documents(self, documents, ordered):
+        """Insert a batch of documents under a single acquisition of the lock.
 
-        if not all(isinstance(k, string_types) for k in data):
-            raise ValueError("Document keys must be strings")
+        All the documents are validated before any is inserted. Documents
+        that would duplicate a unique key are not inserted: if ordered, the
+        insertion stops at the first of them.
 
-        if BSON:
-            # bson validation
-            BSON.encode(data, check_keys=True)
+        Returns the _ids of the documents and the list of write errors, as
+        in the details of a BulkWriteError.
+        """
+        object_ids = [self._prepare_for_insert(document) for document in documents]
+        write_errors = []
+        with self._lock.writer:
+            for position, (object_id, document) in enumerate(zip(object_ids, documents)):
+                index_name = self._find_duplicate_key(object_id, document)
+                if index_name:
+                    write_errors.append({
+                        'index': position,
+                        'code': 11000,
+                        'errmsg': 'E11000 duplicate key error collection: %s index: %s' % (
+                            self.full_name, index_name),
+                        'op': document,
+                    })
+                    if ordered:
+                        break
+                    continue
+                self._store_document(object_id, document)
+        return [document['_id'] for document in documents], write_errors
+
+    def _prepare_for_insert(self, data):
+        """Validate a document and give it an _id if needed.
+
+        Returns the key under which to store the document.
+        """
+        if self._validate_bson != 'off':
+            if not all(isinstance(k, string_types) for k in data):
+                raise ValueError("Document keys must be strings")
+            if self._validate_bson == 'lightweight':
+                helpers.check_bson_document(data)
+            elif BSON:
+                # bson validation
+                BSON.encode(data, check_keys=True)
 
         if '_id' not in data:
             data['_id'] = ObjectId()
-        object_id = data['_id']
-        if isinstance(object_id, dict):
-            object_id = helpers.hashdict(object_id)
-        if object_id in self._documents:
-            raise DuplicateKeyError("Duplicate Key Error", 11000)
-        for unique, is_sparse in self._uniques:
-            find_kwargs = {}
-            for key, direction in unique:
-                find_kwargs[key] = data.get(key, None)
-            answer = self.find(find_kwargs)
-            if answer.count() > 0 and not (is_sparse and find_kwargs[key] is None):
+        return _id_key(data['_id'])
+
+    def _store_document(self, object_id, data):
+        """Store a copy of a new document and index it: the lock must be held."""
+        if self._frozen_documents:
+            document = frozen.freeze(data)
+        else:
+            document = self._internalize_dict(data)
+        self._documents[object_id] = document
+        sequence_number = next(self._sequence_counter)
+        self._sequence_numbers[object_id] = sequence_number
+        self._natural_order.append((sequence_number, object_id))
+        for index in itervalues(self._indexes):
+            index.add(object_id, document, sequence_number)
+
+    def _find_duplicate_key(self, doc_id, document):
+        """Get the name of an index whose key the document would duplicate, if any."""
+        if doc_id in self._documents:
+            return '_id_'
+        for index in itervalues(self._indexes):
+            if index.unique and index.has_duplicate(doc_id, document):
+                return index.name
+        return None
+
+    def _check_unique_indexes(self, doc_id, document, unique_indexes):
+        for index in unique_indexes:
+            if index.has_duplicate(doc_id, document):
                 raise DuplicateKeyError("Duplicate Key Error", 11000)
-        with lock:
-            self._documents[object_id] = self._internalize_dict(data)
-        return data['_id']
 
     def _internalize_dict(self, d):
         return {k: copy.deepcopy(v) for k, v in iteritems(d)}
@@ -388,256 +482,94 @@ class Collection(object):
                 multi=False, check_keys=False, **kwargs):
         validate_is_mapping('spec', spec)
         validate_is_mapping('document', document)
+        plan = _compile_update(document)
+        paths = _update_paths(document)
 
         updated_existing = False
         upserted_id = None
         num_updated = 0
-        for existing_document in itertools.chain(self._iter_documents(spec), [None]):
-            # we need was_insert for the setOnInsert update operation
-            was_insert = False
-            # the sentinel document means we should do an upsert
-            if existing_document is None:
-                if not upsert or num_updated:
-                    continue
-                _id = document.get('_id')
-                to_insert = dict(spec, _id=_id) if _id else spec
-                to_insert = self._expand_dots(to_insert)
-                upserted_id = self._insert(self._discard_operators(to_insert))
-                existing_document = self._documents[upserted_id]
-                was_insert = True
-            else:
-                updated_existing = True
-            num_updated += 1
-            first = True
-            subdocument = None
-            for k, v in iteritems(document):
-                if k in _updaters.keys():
-                    updater = _updaters[k]
-                    subdocument = self._update_document_fields_with_positional_awareness(
-                        existing_document, v, spec, updater, subdocument)
-
-                elif k == '$setOnInsert':
-                    if not was_insert:
+        num_modified = 0
+        with self._lock.writer:
+            # only the indexes of the fields the update may modify are updated
+            updated_indexes = [
+                index for index in itervalues(self._indexes) if _index_overlaps(index, paths)]
+            unique_indexes = [index for index in updated_indexes if index.unique]
+            for existing_document in itertools.chain(self._iter_documents(spec), [None]):
+                # we need was_insert for the setOnInsert update operation
+                was_insert = False
+                # the sentinel document means we should do an upsert
+                if existing_document is None:
+                    if not upsert or num_updated:
                         continue
-                    subdocument = self._update_document_fields_with_positional_awareness(
-                        existing_document, v, spec, _set_updater, subdocument)
-
-                elif k == '$currentDate':
-                    for value in itervalues(v):
-                        if value == {'$type': 'timestamp'}:
-                            raise NotImplementedError('timestamp is not supported so far')
-
-                    subdocument = self._update_document_fields_with_positional_awareness(
-                        existing_document, v, spec, _current_date_updater, subdocument)
-
-                elif k == '$addToSet':
-                    for field, value in iteritems(v):
-                        nested_field_list = field.rsplit('.')
-                        if len(nested_field_list) == 1:
-                            if field not in existing_document:
-                                existing_document[field] = []
-                            # document should be a list append to it
-                            if isinstance(value, dict):
-                                if '$each' in value:
-                                    # append the list to the field
-                                    existing_document[field] += [
-                                        obj for obj in list(value['$each'])
-                                        if obj not in existing_document[field]]
-                                    continue
-                            if value not in existing_document[field]:
-                                existing_document[field].append(value)
-                            continue
-                        # push to array in a nested attribute
-                        else:
-                            # create nested attributes if they do not exist
-                            subdocument = existing_document
-                            for field in nested_field_list[:-1]:
-                                if field not in subdocument:
-                                    subdocument[field] = {}
-
-                                subdocument = subdocument[field]
-
-                            # we're pushing a list
-                            push_results = []
-                            if nested_field_list[-1] in subdocument:
-                                # if the list exists, then use that list
-                                push_results = subdocument[
-                                    nested_field_list[-1]]
-
-                            if isinstance(value, dict) and '$each' in value:
-                                push_results += [
-                                    obj for obj in list(value['$each'])
-                                    if obj not in push_results]
-                            elif value not in push_results:
-                                push_results.append(value)
-
-                            subdocument[nested_field_list[-1]] = push_results
-                elif k == '$pull':
-                    for field, value in iteritems(v):
-                        nested_field_list = field.rsplit('.')
-                        # nested fields includes a positional element
-                        # need to find that element
-                        if '$' in nested_field_list:
-                            if not subdocument:
-                                subdocument = self._get_subdocument(
-                                    existing_document, spec, nested_field_list)
-
-                            # value should be a dictionary since we're pulling
-                            pull_results = []
-                            # and the last subdoc should be an array
-                            for obj in subdocument[nested_field_list[-1]]:
-                                if isinstance(obj, dict):
-                                    for pull_key, pull_value in iteritems(value):
-                                        if obj[pull_key] != pull_value:
-                                            pull_results.append(obj)
-                                    continue
-                                if obj != value:
-                                    pull_results.append(obj)
-
-                            # cannot write to doc directly as it doesn't save to
-                            # existing_document
-                            subdocument[nested_field_list[-1]] = pull_results
-                        else:
-                            arr = existing_document
-                            for field in nested_field_list:
-                                if field not in arr:
-                                    break
-                                arr = arr[field]
-                            if not isinstance(arr, list):
-                                continue
-
-                            if isinstance(value, dict):
-                                for idx, obj in enumerate(arr):
-                                    if filter_applies(value, obj):
-                                        del arr[idx]
-                            else:
-                                for idx, obj in enumerate(arr):
-                                    if value == obj:
-                                        del arr[idx]
-                elif k == '$pullAll':
-                    for field, value in iteritems(v):
-                        nested_field_list = field.rsplit('.')
-                        if len(nested_field_list) == 1:
-                            if field in existing_document:
-                                arr = existing_document[field]
-                                existing_document[field] = [
-                                    obj for obj in arr if obj not in value]
-                            continue
-                        else:
-                            subdocument = existing_document
-                            for nested_field in nested_field_list[:-1]:
-                                if nested_field not in subdocument:
-                                    break
-                                subdocument = subdocument[nested_field]
-
-                            if nested_field_list[-1] in subdocument:
-                                arr = subdocument[nested_field_list[-1]]
-                                subdocument[nested_field_list[-1]] = [
-                                    obj for obj in arr if obj not in value]
-                elif k == '$push':
-                    for field, value in iteritems(v):
-                        nested_field_list = field.rsplit('.')
-                        if len(nested_field_list) == 1:
-                            if field not in existing_document:
-                                existing_document[field] = []
-                            # document should be a list
-                            # append to it
-                            if isinstance(value, dict):
-                                if '$each' in value:
-                                    # append the list to the field
-                                    existing_document[field] += list(value['$each'])
-                                    continue
-                            existing_document[field].append(value)
-                            continue
-                        # nested fields includes a positional element
-                        # need to find that element
-                        elif '$' in nested_field_list:
-                            if not subdocument:
-                                subdocument = self._get_subdocument(
-                                    existing_document, spec, nested_field_list)
-
-                            # we're pushing a list
-                            push_results = []
-                            if nested_field_list[-1] in subdocument:
-                                # if the list exists, then use that list
-                                push_results = subdocument[nested_field_list[-1]]
-
-                            if isinstance(value, dict):
-                                # check to see if we have the format
-                                # { '$each': [] }
-                                if '$each' in value:
-                                    push_results += list(value['$each'])
-                                else:
-                                    push_results.append(value)
-                            else:
-                                push_results.append(value)
-
-                            # cannot write to doc directly as it doesn't save to
-                            # existing_document
-                            subdocument[nested_field_list[-1]] = push_results
-                        # push to array in a nested attribute
-                        else:
-                            # create nested attributes if they do not exist
-                            subdocument = existing_document
-                            for field in nested_field_list[:-1]:
-                                if field not in subdocument:
-                                    subdocument[field] = {}
-                                subdocument = subdocument[field]
-
-                            # we're pushing a list
-                            push_results = []
-                            if nested_field_list[-1] in subdocument:
-                                # if the list exists, then use that list
-                                push_results = subdocument[nested_field_list[-1]]
-
-                            if isinstance(value, dict) and '$each' in value:
-                                push_results += list(value['$each'])
-                            else:
-                                push_results.append(value)
-
-                            subdocument[nested_field_list[-1]] = push_results
+                    _id = document.get('_id')
+                    to_insert = dict(spec, _id=_id) if _id else spec
+                    to_insert = self._expand_dots(to_insert)
+                    upserted_id = self._insert(self._discard_operators(to_insert))
+                    existing_document = self._documents[_id_key(upserted_id)]
+                    was_insert = True
                 else:
-                    if first:
-                        # replace entire document
-                        for key in document.keys():
-                            if key.startswith('$'):
-                                # can't mix modifiers with non-modifiers in
-                                # update
-                                raise ValueError('field names cannot start with $ [{}]'.format(k))
-                        _id = spec.get('_id', existing_document.get('_id'))
-                        existing_document.clear()
-                        if _id:
-                            existing_document['_id'] = _id
-                        existing_document.update(self._internalize_dict(document))
-                        if existing_document['_id'] != _id:
-                            raise OperationFailure(
-                                "The _id field cannot be changed from {0} to {1}"
-                                .format(existing_document['_id'], _id))
-                        break
-                    else:
-                        # can't mix modifiers with non-modifiers in update
-                        raise ValueError(
-                            'Invalid modifier specified: {}'.format(k))
-                first = False
-            # if empty document comes
-            if len(document) == 0:
-                _id = spec.get('_id', existing_document.get('_id'))
-                existing_document.clear()
-                if _id:
-                    existing_document['_id'] = _id
-            if not multi:
-                break
+                    updated_existing = True
+                num_updated += 1
+                doc_id = _id_key(existing_document['_id'])
+                # the original values of the paths the update may modify tell
+                # whether it modified the document
+                if self._frozen_documents:
+                    # update a copy: the stored document is only replaced on success
+                    original_values = [
+                        _path_snapshot(existing_document, path) for path in paths]
+                    existing_document = frozen.thaw(existing_document)
+                else:
+                    original_values = []
+                    for path in paths:
+                        path, value = _path_snapshot(existing_document, path)
+                        # a replacement drops the values, other updates may modify them
+                        original_values.append(
+                            (path, dict(value) if not path else copy.deepcopy(value)))
+                try:
+                    self._apply_update(existing_document, plan, spec, was_insert)
+                    if unique_indexes:
+                        self._check_unique_indexes(doc_id, existing_document, unique_indexes)
+                except DuplicateKeyError:
+                    if was_insert:
+                        self._delete_document(doc_id)
+                    elif not self._frozen_documents:
+                        # restore the inner values first, then the ones holding them
+                        for path, value in sorted(
+                                original_values, key=lambda snapshot: -len(snapshot[0])):
+                            _restore_path_value(existing_document, path, value)
+                    raise
+                else:
+                    if not was_insert and any(
+                            not _is_same_value(_get_path_value(existing_document, path), value)
+                            for path, value in original_values):
+                        num_modified += 1
+                    if self._frozen_documents:
+                        self._documents[doc_id] = frozen.freeze(existing_document)
+                finally:
+                    if doc_id in self._documents:
+                        for index in updated_indexes:
+                            index.update(
+                                doc_id, self._documents[doc_id], self._sequence_numbers[doc_id])
+                if not multi:
+                    break
 
         return {
             text_type("connectionId"): self.database.client._id,
             text_type("err"): None,
             text_type("n"): num_updated,
-            text_type("nModified"): num_updated if updated_existing else 0,
+            text_type("nModified"): num_modified,
             text_type("ok"): 1,
             text_type("upserted"): upserted_id,
             text_type("updatedExisting"): updated_existing,
         }
 
+    def _apply_update(self, existing_document, plan, spec, was_insert):
+        """Apply an update plan built by _compile_update to a document, in place."""
+        # the subdocument found by a positional operator is shared by the operators
+        subdocument = None
+        for apply_operator in plan:
+            subdocument = apply_operator(self, existing_document, spec, subdocument, was_insert)
+
     def _get_subdocument(self, existing_document, spec, nested_field_list):
         """This method retrieves the subdocument of the existing_document.nested_field_list.
 
@@ -706,19 +638,36 @@ class Collection(object):
         if spec is None:
             spec = {}
         validate_is_mapping('filter', spec)
-        return Cursor(self, spec, sort, projection, skip, limit)
+        return Cursor(self, spec, sort, projection, skip, limit, batch_size)
 
-    def _get_dataset(self, spec, sort, fields, as_class):
-        dataset = (self._copy_only_fields(document, fields, as_class)
-                   for document in self._iter_documents(spec))
-        if sort:
-            for sortKey, sortDirection in reversed(sort):
-                dataset = iter(sorted(
-                    dataset, key=lambda x: _resolve_sort_key(sortKey, x),
-                    reverse=sortDirection < 0))
-        return dataset
+    def _iter_batches(self, spec, sort, fields, as_class, skip, limit, batch_size):
+        """Iterate over the projected copies of the matching documents, in lists of batch_size.
+
+        The documents of a batch are only read and copied when the batch is
+        requested, under a single acquisition of the lock.
+        """
+        documents = self._iter_documents(spec, sort, skip=skip, limit=limit, projection=fields)
+        project = None
+        while True:
+            batch = list(itertools.islice(documents, batch_size))
+            if not batch:
+                return
+            if project is None:
+                # errors in the projection are only raised when a document is found
+                project = self._compile_projection(fields, as_class)
+            if self._frozen_documents:
+                # frozen documents are never modified: they are replaced under the lock
+                yield [project(document) for document in batch]
+                continue
+            with self._lock.reader:
+                batch = [project(document) for document in batch]
+            yield batch
 
     def _copy_field(self, obj, container):
+        if self._frozen_documents and container is dict:
+            return frozen.view(obj)
+        if isinstance(obj, helpers.IMMUTABLE_TYPES):
+            return obj
         if isinstance(obj, list):
             new = []
             for item in obj:
@@ -730,153 +679,128 @@ class Collection(object):
                 new[key] = self._copy_field(value, container)
             return new
         else:
-            return copy.copy(obj)
+            return copy.deepcopy(obj)
 
-    def _extract_projection_operators(self, fields):
-        """Removes and returns fields with projection operators."""
-        result = {}
-        allowed_projection_operators = {'$elemMatch'}
+    def _compile_projection(self, fields, container):
+        """Compile a projection into a function copying the projected fields of a document.
+
+        The projection is validated and its keys are split into a trie of
+        paths only once. Only the included subtrees are copied, and the
+        excluded ones are skipped instead of being copied and then deleted.
+        """
+        copy_field = self._copy_field
+        if fields is None:
+            return lambda doc: copy_field(doc, container)
+        if not fields:
+            fields = {'_id': 1}
+        if not isinstance(fields, dict):
+            fields = helpers._fields_list_to_dict(fields)
+
+        # we can pass in something like {"_id":0, "field":1}, so the _id
+        # value is handled on its own
+        id_value = fields.get('_id', 1)
+        keys = []
+        values = set()
+        elem_matchers = []
         for key, value in iteritems(fields):
+            if key == '_id':
+                continue
             if isinstance(value, dict):
+                # fields with projection operators are handled after the copy
                 for op in value:
-                    if op not in allowed_projection_operators:
+                    if op != '$elemMatch':
                         raise ValueError('Unsupported projection option: {}'.format(op))
-                result[key] = value
-
-        for key in result:
-            del fields[key]
-
-        return result
-
-    def _apply_projection_operators(self, ops, doc, doc_copy):
-        """Applies projection operators to copied document."""
-        for field, op in iteritems(ops):
-            if field not in doc_copy:
-                if field in doc:
-                    # field was not copied yet (since we are in include mode)
-                    doc_copy[field] = doc[field]
-                else:
-                    # field doesn't exist in original document, no work to do
+                elem_matchers.append((key, self._compile_filter(value['$elemMatch'])))
+                continue
+            keys.append(key)
+            values.add(value)
+
+        # other than the _id field, all fields must be either includes or
+        # excludes, this can evaluate to 0
+        if len(values) > 1:
+            raise ValueError('You cannot currently mix including and excluding fields.')
+        # with no fields, either only the _id is included or nothing is excluded
+        include = values.pop() == 1 if values else id_value == 1
+        trie = _projection_trie(keys)
+
+        def copy_included(value, trie):
+            value_copy = container()
+            for key, subtrie in iteritems(trie):
+                if key not in value:
                     continue
-
-            if '$elemMatch' in op:
-                if isinstance(doc_copy[field], list):
-                    # find the first item that matches
-                    matched = False
-                    for item in doc_copy[field]:
-                        if filter_applies(op['$elemMatch'], item):
-                            matched = True
-                            doc_copy[field] = [item]
-                            break
-
-                    # nothing have matched
-                    if not matched:
-                        del doc_copy[field]
-
+                subvalue = value[key]
+                if subtrie is True:
+                    value_copy[key] = copy_field(subvalue, container)
+                elif isinstance(subvalue, dict):
+                    value_copy[key] = copy_included(subvalue, subtrie)
+                elif isinstance(subvalue, (list, tuple)):
+                    items = (
+                        copy_included(item, subtrie)
+                        for item in subvalue if isinstance(item, dict))
+                    value_copy[key] = [item for item in items if item]
+            return value_copy
+
+        def copy_not_excluded(value, trie):
+            value_copy = container()
+            for key, subvalue in iteritems(value):
+                subtrie = trie.get(key)
+                if subtrie is True:
+                    continue
+                if subtrie is None:
+                    value_copy[key] = copy_field(subvalue, container)
+                elif isinstance(subvalue, dict):
+                    value_copy[key] = copy_not_excluded(subvalue, subtrie)
+                elif isinstance(subvalue, (list, tuple)):
+                    value_copy[key] = [
+                        copy_not_excluded(item, subtrie) if isinstance(item, dict)
+                        else copy_field(item, container)
+                        for item in subvalue]
                 else:
-                    # remove the field since there is nothing to iterate
-                    del doc_copy[field]
-
-    def _copy_only_fields(self, doc, fields, container):
-        """Copy only the specified fields."""
+                    value_copy[key] = copy_field(subvalue, container)
+            return value_copy
 
-        if fields is None:
-            return self._copy_field(doc, container)
-        else:
-            if not fields:
-                fields = {"_id": 1}
-            if not isinstance(fields, dict):
-                fields = helpers._fields_list_to_dict(fields)
-
-            # we can pass in something like {"_id":0, "field":1}, so pull the id
-            # value out and hang on to it until later
-            id_value = fields.pop('_id', 1)
-
-            # filter out fields with projection operators, we will take care of them later
-            projection_operators = self._extract_projection_operators(fields)
-
-            # other than the _id field, all fields must be either includes or
-            # excludes, this can evaluate to 0
-            if len(set(list(fields.values()))) > 1:
-                raise ValueError(
-                    'You cannot currently mix including and excluding fields.')
-
-            # if we have novalues passed in, make a doc_copy based on the
-            # id_value
-            if len(list(fields.values())) == 0:
-                if id_value == 1:
-                    doc_copy = container()
-                else:
-                    doc_copy = self._copy_field(doc, container)
-            # if 1 was passed in as the field values, include those fields
-            elif list(fields.values())[0] == 1:
-                doc_copy = container()
-                for key in fields:
-                    key_parts = key.split('.')
-                    subdocument = doc
-                    subdocument_copy = doc_copy
-                    last_copy = subdocument_copy
-                    full_key_path_found = True
-                    for key_part in key_parts[:-1]:
-                        if key_part not in subdocument:
-                            full_key_path_found = False
-                            break
-                        subdocument = subdocument[key_part]
-                        last_copy = subdocument_copy
-                        subdocument_copy = subdocument_copy.setdefault(key_part, {})
-
-                    if full_key_path_found:
-                        last_key = key_parts[-1]
-                        if isinstance(subdocument, dict) and last_key in subdocument:
-                            subdocument_copy[last_key] = subdocument[last_key]
-                        elif isinstance(subdocument, (list, tuple)):
-                            subdocument = [{last_key: x[last_key]}
-                                           for x in subdocument if last_key in x]
-                            if subdocument:
-                                last_copy[key_parts[-2]] = subdocument
-            # otherwise, exclude the fields passed in
+        def project(doc):
+            if include:
+                doc_copy = copy_included(doc, trie)
             else:
-                doc_copy = self._copy_field(doc, container)
-                for key in fields:
-                    key_parts = key.split('.')
-                    subdocument_copy = doc_copy
-                    full_key_path_found = True
-                    for key_part in key_parts[:-1]:
-                        if key_part not in subdocument_copy:
-                            full_key_path_found = False
-                            break
-                        subdocument_copy = subdocument_copy[key_part]
-                    if not full_key_path_found or key_parts[-1] not in subdocument_copy:
-                        continue
-                    del subdocument_copy[key_parts[-1]]
+                doc_copy = copy_not_excluded(doc, trie)
 
             # set the _id value if we requested it, otherwise remove it
             if id_value == 0:
                 doc_copy.pop('_id', None)
-            else:
-                if '_id' in doc:
-                    doc_copy['_id'] = doc['_id']
-
-            fields['_id'] = id_value  # put _id back in fields
-
-            # time to apply the projection operators and put back their fields
-            self._apply_projection_operators(projection_operators, doc, doc_copy)
-            for field, op in iteritems(projection_operators):
-                fields[field] = op
+            elif '_id' in doc:
+                doc_copy['_id'] = doc['_id']
+
+            # time to apply the projection operators
+            for field, matcher in elem_matchers:
+                if field not in doc_copy:
+                    if field not in doc:
+                        # field doesn't exist in original document, no work to do
+                        continue
+                    # field was not copied yet (since we are in include mode)
+                    doc_copy[field] = copy_field(doc[field], dict)
+                value = doc_copy[field]
+                # keep the first item that matches, or remove the field
+                del doc_copy[field]
+                if isinstance(value, list):
+                    for item in value:
+                        if matcher(item):
+                            doc_copy[field] = [item]
+                            break
             return doc_copy
+        return project
 
-    def _update_document_fields(self, doc, fields, updater):
+    def _update_document_fields(self, doc, operations, updater):
         """Implements the $set behavior on an existing document"""
-        for k, v in iteritems(fields):
-            self._update_document_single_field(doc, k, v, updater)
+        for unused_field, field_name_parts, value in operations:
+            self._update_document_single_field(doc, field_name_parts, value, updater)
 
-    def _update_document_fields_positional(self, doc, fields, spec, updater,
+    def _update_document_fields_positional(self, doc, operations, spec, updater,
                                            subdocument=None):
         """Implements the $set behavior on an existing document"""
-        for k, v in iteritems(fields):
+        for k, field_name_parts, v in operations:
             if '$' in k:
 
-                field_name_parts = k.split('.')
                 if not subdocument:
                     current_doc = doc
                     subspec = spec
@@ -912,22 +836,11 @@ class Collection(object):
                 updater(subdocument, field_name_parts[-1], v)
                 continue
             # otherwise, we handle it the standard way
-            self._update_document_single_field(doc, k, v, updater)
-
-        return subdocument
-
-    def _update_document_fields_with_positional_awareness(self, existing_document, v, spec,
-                                                          updater, subdocument):
-        positional = any('$' in key for key in iterkeys(v))
+            self._update_document_single_field(doc, field_name_parts, v, updater)
 
-        if positional:
-            return self._update_document_fields_positional(
-                existing_document, v, spec, updater, subdocument)
-        self._update_document_fields(existing_document, v, updater)
         return subdocument
 
-    def _update_document_single_field(self, doc, field_name, field_value, updater):
-        field_name_parts = field_name.split(".")
+    def _update_document_single_field(self, doc, field_name_parts, field_value, updater):
         for part in field_name_parts[:-1]:
             if isinstance(doc, list):
                 try:
@@ -951,9 +864,315 @@ class Collection(object):
         else:
             updater(doc, field_name, field_value)
 
-    def _iter_documents(self, filter=None):
-        return (document for document in list(itervalues(self._documents))
-                if filter_applies(filter, document))
+    def _compile_filter(self, filter):
+        return compile_filter(filter, self.database.client.filter_cache)
+
+    def _iter_documents(self, filter=None, sort=None, stats=None, skip=0, limit=None,
+                        projection=None):
+        """Iterate over the documents matching filter, in the order of sort.
+
+        The first skip documents are skipped and at most limit documents are
+        returned: they are skipped before being copied, and by their position
+        in the index when an index gives all the matching documents in order.
+
+        If a projection is given and an index holds all the fields the query
+        reads, the query is covered: the documents only hold those fields, and
+        are built from the values of the index instead of being read.
+
+        If stats is a dict, it gets the plan of the query under 'stage', as
+        the tree of stages of an explain output, whose counters are updated
+        while the documents are iterated, and whether the query is covered
+        under 'covered'.
+        """
+        # pymongo takes a negative limit as its absolute value
+        stop = skip + abs(limit) if limit else None
+        with self._lock.reader:
+            covering_index = self._find_covering_index(filter, sort, projection)
+            doc_ids, is_sorted, stage = self._lookup_indexes(filter, sort)
+            if doc_ids is None and covering_index is not None:
+                # scan the entries of the index rather than the documents
+                reverse = covering_index.sort_direction(sort) if sort else None
+                start, end = covering_index.find_range()
+                doc_ids = covering_index.ids_between(start, end, bool(reverse))
+                is_sorted = reverse is not None
+                if not is_sorted:
+                    # the index does not give the order: keep the natural one
+                    doc_ids.sort(key=self._sequence_numbers.__getitem__)
+                stage = covering_index.explain(reverse=bool(reverse), keys_examined=end - start)
+            if doc_ids is None:
+                documents = self._scan_documents()
+            else:
+                if is_sorted and not filter and (skip or stop is not None):
+                    # all the documents match: skip them in the index entries
+                    doc_ids = doc_ids[skip:stop]
+                    skip, stop = 0, None
+                if covering_index is None:
+                    documents = [self._documents[doc_id] for doc_id in doc_ids]
+                else:
+                    documents = [covering_index.covered_document(doc_id) for doc_id in doc_ids]
+        if doc_ids is None:
+            stage = {'stage': 'COLLSCAN', 'direction': 'forward'}
+        elif stage['stage'] == 'IXSCAN' and covering_index is None:
+            stage = {'stage': 'FETCH', 'inputStage': stage}
+        if stats is not None:
+            stats['covered'] = covering_index is not None
+            if filter:
+                stage['filter'] = filter
+            if covering_index is None:
+                stage['docsExamined'] = 0
+                documents = _count_examined_documents(documents, stage)
+        documents = self._filter_documents(documents, self._compile_filter(filter))
+        if sort and not is_sorted:
+            with self._lock.reader:
+                documents = iter(_sort_documents(documents, sort, stop))
+            stage = {
+                'stage': 'SORT',
+                'sortPattern': OrderedDict(sort),
+                'limitAmount': stop or 0,
+                'inputStage': stage,
+            }
+        if stats is not None:
+            stats['stage'] = stage
+        if skip or stop is not None:
+            documents = itertools.islice(documents, skip, stop)
+        return documents
+
+    def _find_covering_index(self, filter, sort, projection):
+        """Find an index holding all the fields a query reads, or None.
+
+        The projection must only include fields, and exclude _id unless it is
+        one of those fields. The filter must not have top level operators.
+        """
+        if not projection or not isinstance(filter, collections.Mapping):
+            return None
+        if not isinstance(projection, dict):
+            projection = dict.fromkeys(projection, 1)
+        fields = set()
+        for key, value in iteritems(projection):
+            if key != '_id':
+                if isinstance(value, dict) or value != 1:
+                    return None
+                fields.add(key)
+        if not fields:
+            return None
+        if projection.get('_id', 1) != 0:
+            fields.add('_id')
+        for key in filter:
+            if not isinstance(key, string_types) or key.startswith('$'):
+                return None
+            fields.add(key)
+        fields.update(key for key, unused_direction in sort or ())
+        for index in itervalues(self._indexes):
+            if index.covers(fields):
+                return index
+        return None
+
+    def _join_on(self, field):
+        """Get a function finding the documents whose field holds one of some values.
+
+        This is how $lookup joins the documents of this collection: the
+        function returns copies of the matching documents in natural order. It
+        looks them up in an index on the field if there is one, or else in a
+        hash table of the documents by the values of the field, built on the
+        first call over the documents stored then.
+        """
+        hash_table = []
+
+        def join(values):
+            with self._lock.reader:
+                index = next((
+                    index for index in itervalues(self._indexes)
+                    if index.fields == [field] and not index.sparse), None)
+                if index is None:
+                    if not hash_table:
+                        hash_table.append(indexes.Index([(field, 'hashed')]))
+                        for doc_id, document in iteritems(self._documents):
+                            hash_table[0].add(doc_id, document, self._sequence_numbers[doc_id])
+                    index = hash_table[0]
+                doc_ids = index.lookup([values])
+                if doc_ids is None:
+                    # the values cannot be hashed
+                    doc_ids = self._documents
+                documents = [
+                    self._documents[doc_id]
+                    for doc_id in sorted(
+                        (doc_id for doc_id in doc_ids if doc_id in self._documents),
+                        key=self._sequence_numbers.__getitem__)]
+                # lookups also return the documents that cannot be hashed, and
+                # the hash table is not updated when the documents are
+                return [
+                    self._copy_field(document, dict) for document in documents
+                    if _holds_join_value(document, field, values)]
+
+        return join
+
+    def _scan_documents(self):
+        """Iterate lazily over a snapshot of the stored documents, in natural order.
+
+        The snapshot holds the documents stored when this is called: the ones
+        inserted later are skipped, using their sequence numbers as version
+        stamps, and the ones deleted in the meantime are skipped when reached.
+        """
+        return self._iter_natural_order(
+            self._natural_order, len(self._natural_order),
+            self._documents, self._sequence_numbers)
+
+    @staticmethod
+    def _iter_natural_order(natural_order, end, documents, sequence_numbers):
+        get_sequence_number = sequence_numbers.get
+        get_document = documents.get
+        for sequence_number, doc_id in itertools.islice(natural_order, end):
+            if get_sequence_number(doc_id) != sequence_number:
+                # deleted, or deleted and inserted again after the snapshot
+                continue
+            document = get_document(doc_id)
+            if document is not None:
+                yield document
+
+    def _filter_documents(self, documents, matcher):
+        """Filter stored documents, reading them under the lock a chunk at a time.
+
+        An error raised by the filter on a document is raised once the
+        documents before it are returned, as when filtering one at a time.
+        """
+        if self._frozen_documents:
+            for document in documents:
+                if matcher(document):
+                    yield document
+            return
+        lock = self._lock
+        documents = iter(documents)
+        while True:
+            matching = []
+            error = None
+            lock.acquire_read()
+            try:
+                chunk = list(itertools.islice(documents, _SCAN_CHUNK_SIZE))
+                for document in chunk:
+                    try:
+                        if matcher(document):
+                            matching.append(document)
+                    except Exception as matcher_error:
+                        error = matcher_error
+                        break
+            finally:
+                lock.release_read()
+            for document in matching:
+                yield document
+            if error is not None:
+                raise error
+            if len(chunk) < _SCAN_CHUNK_SIZE:
+                return
+
+    def _lookup_indexes(self, filter, sort=None):
+        """Use the indexes to get the ids of the documents that may match the filter.
+
+        The equality clauses of the filter are looked up in the indexes, the
+        range clauses in the sorted entries of the indexes and the sort is
+        served by an index whose key matches it if possible.
+
+        Returns a triple: the ids of the candidate documents, or None if all
+        the documents have to be scanned, whether those ids are already in the
+        order of the sort, and the IDHACK or IXSCAN stage describing the
+        lookup as in an explain output (None with all the documents). Unsorted
+        ids are in insertion order.
+        """
+        if not isinstance(filter, collections.Mapping):
+            filter = {}
+        values_per_key = {}
+        bounds_per_key = {}
+        for key, search in iteritems(filter):
+            values = indexes.equality_values(search)
+            if values is not None:
+                values_per_key[key] = values
+            bounds = indexes.range_bounds(search)
+            if bounds is not None:
+                bounds_per_key[key] = bounds
+
+        best = None
+        best_stage = None
+        # (index, start, stop) when the best candidates are a range of sorted entries
+        best_range = None
+        if '_id' in values_per_key:
+            try:
+                best = {_id_key(value) for value in values_per_key['_id']
+                        if _id_key(value) in self._documents}
+                best_stage = {'stage': 'IDHACK', 'keysExamined': len(best)}
+            except TypeError:
+                best = None
+        best_size = None if best is None else len(best)
+        for index in itervalues(self._indexes):
+            if best_size is not None and best_size <= 1:
+                break
+            if all(field in values_per_key for field in index.fields):
+                doc_ids = index.lookup([values_per_key[field] for field in index.fields])
+                if doc_ids is not None and (best_size is None or len(doc_ids) < best_size):
+                    best, best_range, best_size = doc_ids, None, len(doc_ids)
+                    best_stage = index.explain(keys_examined=best_size)
+                    continue
+            if index.ordered and index.fields[0] in bounds_per_key:
+                start, stop = index.find_range(*bounds_per_key[index.fields[0]])
+                if best_size is None or stop - start < best_size:
+                    best_range, best_size = (index, start, stop), stop - start
+
+        if best_range is not None:
+            index, start, stop = best_range
+            reverse = index.sort_direction(sort) if sort else None
+            best_stage = index.explain(reverse=bool(reverse), keys_examined=stop - start)
+            if reverse is not None:
+                return index.ids_between(start, stop, reverse), True, best_stage
+            best = set(index.ids_between(start, stop))
+        if best is not None:
+            return sorted(best, key=self._sequence_numbers.__getitem__), False, best_stage
+
+        if sort:
+            for index in itervalues(self._indexes):
+                reverse = index.sort_direction(sort)
+                if reverse is not None and not index.sparse:
+                    start, stop = index.find_range()
+                    return (
+                        index.ids_between(start, stop, reverse=reverse), True,
+                        index.explain(reverse=reverse, keys_examined=stop - start))
+        return None, False, None
+
+    def _explain_query(self, filter, sort=None, projection=None, skip=0, limit=None):
+        """Run a query to describe how it is executed, as the explain command does."""
+        stats = {}
+        start_time = time.time()
+        documents = self._iter_documents(filter, sort, stats, skip, limit, projection)
+        n_returned = sum(1 for unused_document in documents)
+        execution_time = time.time() - start_time
+
+        stage = stats['stage']
+        if projection:
+            stage = {
+                'stage': 'PROJECTION_COVERED' if stats['covered'] else 'PROJECTION',
+                'transformBy': projection,
+                'inputStage': stage,
+            }
+        if skip:
+            stage = {'stage': 'SKIP', 'skipAmount': skip, 'inputStage': stage}
+        if limit:
+            stage = {'stage': 'LIMIT', 'limitAmount': abs(limit), 'inputStage': stage}
+        return {
+            'queryPlanner': {
+                'plannerVersion': 1,
+                'namespace': self.full_name,
+                'indexFilterSet': False,
+                'parsedQuery': filter or {},
+                'winningPlan': _plan_without_stats(stage),
+                'rejectedPlans': [],
+            },
+            'executionStats': {
+                'executionSuccess': True,
+                'nReturned': n_returned,
+                'executionTimeMillis': int(round(execution_time * 1000)),
+                'totalKeysExamined': _sum_stage_stats(stage, 'keysExamined'),
+                'totalDocsExamined': _sum_stage_stats(stage, 'docsExamined'),
+                'executionStages': stage,
+            },
+            'ok': 1.0,
+        }
 
     def find_one(self, filter=None, *args, **kwargs):
         # Allow calling find_one with a non-dict argument that gets used as
@@ -1053,16 +1272,13 @@ class Collection(object):
             filter = {}
         if not isinstance(filter, collections.Mapping):
             filter = {'_id': filter}
-        to_delete = list(self.find(filter))
-        deleted_count = 0
-        for doc in to_delete:
-            doc_id = doc['_id']
-            if isinstance(doc_id, dict):
-                doc_id = helpers.hashdict(doc_id)
-            del self._documents[doc_id]
-            deleted_count += 1
-            if not multi:
-                break
+        with self._lock.writer:
+            deleted_count = 0
+            for doc in self._iter_documents(filter):
+                self._delete_document(_id_key(doc['_id']))
+                deleted_count += 1
+                if not multi:
+                    break
 
         return {
             "connectionId": self.database.client._id,
@@ -1071,6 +1287,20 @@ class Collection(object):
             "err": None,
         }
 
+    def _delete_document(self, doc_id):
+        del self._documents[doc_id]
+        del self._sequence_numbers[doc_id]
+        self._removed_from_natural_order += 1
+        if self._removed_from_natural_order * 2 > len(self._natural_order):
+            # Replace the list rather than modifying it: the scans that are
+            # running keep reading the old one.
+            self._natural_order = [
+                (sequence_number, doc_id) for sequence_number, doc_id in self._natural_order
+                if self._sequence_numbers.get(doc_id) == sequence_number]
+            self._removed_from_natural_order = 0
+        for index in itervalues(self._indexes):
+            index.remove(doc_id)
+
     def remove(self, spec_or_id=None, multi=True, **kwargs):
         warnings.warn("remove is deprecated. Use delete_one or delete_many "
                       "instead.", DeprecationWarning, stacklevel=2)
@@ -1078,26 +1308,101 @@ class Collection(object):
         return self._delete(spec_or_id, multi=multi)
 
     def count(self, filter=None, **kwargs):
-        if filter is None:
+        if filter is not None:
+            validate_is_mapping('filter', filter)
+        return self._count_documents(filter, kwargs.get('skip', 0), kwargs.get('limit', 0))
+
+    def _count_documents(self, filter, skip=0, limit=0):
+        """Count the documents matching filter without copying them.
+
+        Index cardinalities are used if they answer the filter exactly,
+        otherwise matching documents are counted until skip + limit are found.
+        """
+        with self._lock.reader:
+            count = self._count_from_indexes(filter)
+        if count is None:
+            matching = self._iter_documents(filter)
+            if limit:
+                matching = itertools.islice(matching, skip + abs(limit))
+            count = sum(1 for unused_document in matching)
+        if skip:
+            count = max(count - skip, 0)
+        if limit:
+            count = min(count, abs(limit))
+        return count
+
+    def _count_from_indexes(self, filter):
+        """Count the documents matching filter using only the indexes, if possible.
+
+        Only filters with at most one equality to a scalar value are supported.
+        Returns None for other filters.
+        """
+        if not filter:
             return len(self._documents)
-        else:
-            return self.find(filter).count()
+        if len(filter) != 1:
+            return None
+        key, search = next(iteritems(filter))
+        if not isinstance(search, (string_types, numbers.Number, datetime)) or search != search:
+            return None
+        if key == '_id':
+            return int(search in self._documents)
+        for index in itervalues(self._indexes):
+            if index.fields == [key]:
+                count = index.count_equal(search)
+                if count is not None:
+                    return count
+        return None
 
     def drop(self):
         self.database.drop_collection(self.name)
 
+    def _clear(self):
+        """Forget all the documents and indexes of the collection."""
+        with self._lock.writer:
+            self._documents = OrderedDict()
+            self._indexes = OrderedDict()
+            self._sequence_numbers = {}
+            self._natural_order = []
+            self._removed_from_natural_order = 0
+
     def ensure_index(self, key_or_list, cache_for=300, **kwargs):
-        self.create_index(key_or_list, cache_for, **kwargs)
+        return self.create_index(key_or_list, cache_for, **kwargs)
 
     def create_index(self, key_or_list, cache_for=300, **kwargs):
-        if kwargs.pop('unique', False):
-            self._uniques.append((helpers.index_list(key_or_list), kwargs.pop('sparse', False)))
+        index_list = helpers.index_list(key_or_list)
+        index_name = kwargs.pop('name', None) or indexes.gen_index_name(index_list)
+        if index_name in self._indexes:
+            return index_name
+        unique = kwargs.pop('unique', False)
+        index = indexes.Index(
+            index_list, name=index_name, unique=unique, sparse=kwargs.pop('sparse', False))
+        with self._lock.writer:
+            for doc_id, document in iteritems(self._documents):
+                if unique and index.has_duplicate(doc_id, document):
+                    raise DuplicateKeyError("Duplicate Key Error", 11000)
+                index.add(doc_id, document, self._sequence_numbers[doc_id])
+            self._indexes[index_name] = index
+        return index_name
 
     def drop_index(self, index_or_name):
-        pass
+        if isinstance(index_or_name, list):
+            index_name = indexes.gen_index_name(index_or_name)
+        else:
+            index_name = index_or_name
+        if index_name not in self._indexes:
+            raise OperationFailure('index not found with name [%s]' % index_name)
+        with self._lock.writer:
+            del self._indexes[index_name]
+
+    def drop_indexes(self):
+        with self._lock.writer:
+            self._indexes = OrderedDict()
 
     def index_information(self):
-        return {}
+        info = {'_id_': {'v': 1, 'key': [('_id', 1)]}}
+        for index_name, index in iteritems(self._indexes):
+            info[index_name] = index.information()
+        return info
 
     def map_reduce(self, map_func, reduce_func, out, full_response=False,
                    query=None, limit=0):
@@ -1272,10 +1577,10 @@ class Collection(object):
             '$skip',
             '$unwind',
             '$group',
-            '$sample'
+            '$sample',
             '$sort',
             '$geoNear',
-            '$lookup'
+            '$lookup',
             '$out',
             '$indexStats']
         group_operators = [
@@ -1497,162 +1802,232 @@ class Collection(object):
 
             return value_dict
 
-        def _extend_collection(out_collection, field, expression):
-            field_exists = False
-            for doc in out_collection:
-                if field in doc:
-                    field_exists = True
-                    break
-            if not field_exists:
-                for doc in out_collection:
-                    if isinstance(expression, str) and expression.startswith('$'):
-                        try:
-                            doc[field] = get_value_by_dot(doc, expression.lstrip('$'))
-                        except KeyError:
-                            pass
+        def _extend_document(doc, field, expression):
+            if field in doc:
+                return
+            if isinstance(expression, str) and expression.startswith('$'):
+                try:
+                    doc[field] = get_value_by_dot(doc, expression.lstrip('$'))
+                except KeyError:
+                    pass
+            else:
+                # verify expression has operator as first
+                doc[field] = _parse_expression(expression.copy(), doc)
+
+        def _handle_project_stage(in_collection, projection):
+            filter_list = ['_id']
+            extended_fields = []
+            for field, value in iteritems(projection):
+                if field == '_id' and not value:
+                    filter_list.remove('_id')
+                elif value:
+                    filter_list.append(field)
+                    extended_fields.append((field, value))
+            for doc in in_collection:
+                for field, value in extended_fields:
+                    _extend_document(doc, field, value)
+                yield {k: v for (k, v) in doc.items() if k in filter_list}
+
+        def _handle_match_stage(in_collection, matcher):
+            for doc in in_collection:
+                if matcher(doc):
+                    yield doc
+
+        def _handle_sort_stage(in_collection, sort):
+            for doc in _sort_documents(in_collection, sort):
+                yield doc
+
+        def _handle_unwind_stage(in_collection, path):
+            for doc in in_collection:
+                array_value = get_value_by_dot(doc, path[1:])
+                if array_value in (None, []):
+                    continue
+                elif not isinstance(array_value, list):
+                    raise TypeError(
+                        '$unwind must specify an array field, field: '
+                        '"%s", value found: %s' % (path, array_value))
+                for field_item in array_value:
+                    yield set_value_by_dot(copy.deepcopy(doc), path[1:], field_item)
+
+        def _handle_lookup_stage(in_collection, lookup):
+            for option in ('from', 'as'):
+                if not isinstance(lookup.get(option), helpers.basestring):
+                    raise OperationFailure(
+                        "missing '%s' option to $lookup stage specification: %s" %
+                        (option, lookup))
+            foreign_collection = self.database.get_collection(lookup['from'])
+            if 'pipeline' in lookup:
+                sub_pipeline = list(lookup['pipeline'])
+                if not lookup.get('let'):
+                    return _iter_uncorrelated_lookup(
+                        in_collection, foreign_collection, sub_pipeline, lookup['as'])
+                join_fields = sub_pipeline and \
+                    _correlated_join_fields(lookup['let'], sub_pipeline[0])
+                if not join_fields:
+                    raise NotImplementedError(
+                        'Although a $lookup pipeline may use any variable, only the ones '
+                        "starting with {'$match': {'$expr': {'$eq': ['$<foreignField>', "
+                        "'$$<variable>']}}} are currently implemented in Mongomock.")
+                local_field, foreign_field = join_fields
+                sub_pipeline = sub_pipeline[1:]
+            elif 'localField' in lookup and 'foreignField' in lookup:
+                local_field, foreign_field = lookup['localField'], lookup['foreignField']
+                sub_pipeline = []
+            else:
+                raise OperationFailure(
+                    "$lookup requires either 'pipeline' or both 'localField' and "
+                    "'foreignField' to be specified")
+            return _iter_lookup(
+                in_collection, foreign_collection._join_on(foreign_field),
+                local_field, sub_pipeline, lookup['as'])
+
+        def _iter_lookup(in_collection, join, local_field, sub_pipeline, as_field):
+            for doc in in_collection:
+                matches = join(_join_values(doc, local_field))
+                if sub_pipeline:
+                    matches = list(_run_stages(iter(matches), sub_pipeline))
+                yield set_value_by_dot(doc, as_field, matches)
+
+        def _iter_uncorrelated_lookup(in_collection, foreign_collection, sub_pipeline, as_field):
+            # the pipeline does not depend on the documents: it is run once
+            results = None
+            for doc in in_collection:
+                if results is None:
+                    results = list(foreign_collection.aggregate(sub_pipeline))
+                yield set_value_by_dot(doc, as_field, copy.deepcopy(results))
+
+        def _handle_group_stage(in_collection, group):
+            accumulators = []
+            for field, value in iteritems(group):
+                if field == '_id':
+                    continue
+                for operator, key in iteritems(value):
+                    if operator in _GROUP_ACCUMULATORS:
+                        accumulators.append(
+                            (field, operator, key, _GROUP_ACCUMULATORS[operator]))
+                    elif operator in group_operators:
+                        raise NotImplementedError(
+                            "Although %s is a valid group operator for the "
+                            "aggregation pipeline, it is currently not implemented "
+                            "in Mongomock." % operator)
                     else:
-                        # verify expression has operator as first
-                        doc[field] = _parse_expression(expression.copy(), doc)
-            return out_collection
+                        raise NotImplementedError(
+                            "%s is not a valid group operator for the aggregation "
+                            "pipeline. See http://docs.mongodb.org/manual/meta/"
+                            "aggregation-quick-reference/ for a complete list of "
+                            "valid operators." % operator)
+
+            return _iter_groups(in_collection, group['_id'], accumulators)
+
+        def _iter_groups(in_collection, _id, accumulators):
+            # Groups in the order they are first met, as (_id, accumulators)
+            # pairs, and their positions by hashed _id.
+            groups = []
+            positions = {}
+            for doc in in_collection:
+                doc_id = _parse_expression(_id, doc) if _id else None
+                try:
+                    hashed_id = indexes.hashable_value(doc_id)
+                    position = positions.get(hashed_id)
+                except TypeError:
+                    hashed_id = NOTHING
+                    position = next((
+                        i for i, (other_id, unused) in enumerate(groups) if other_id == doc_id
+                    ), None)
+                if position is None:
+                    position = len(groups)
+                    groups.append((doc_id, [
+                        accumulator() for unused, unused, unused, accumulator in accumulators]))
+                    if hashed_id is not NOTHING:
+                        positions[hashed_id] = position
+                for (unused, unused, key, unused), state in zip(
+                        accumulators, groups[position][1]):
+                    state.add(_parse_expression(key, doc))
+
+            for doc_id, states in groups:
+                doc_dict = {'_id': doc_id}
+                for (field, operator, unused, unused), state in zip(accumulators, states):
+                    if operator == '$push':
+                        doc_dict.setdefault(field, []).extend(state.result())
+                    else:
+                        doc_dict[field] = state.result()
+                yield doc_dict
 
         conditional_operators = ['$cond', '$ifNull']  # noqa
-        out_collection = [doc for doc in self.find()]
-        for stage in pipeline:
-            for k, v in iteritems(stage):
-                if k == '$match':
-                    out_collection = [doc for doc in out_collection
-                                      if filter_applies(v, doc)]
-                elif k == '$group':
-                    grouped_collection = []
-                    _id = stage['$group']['_id']
-                    if _id:
-                        key_getter = functools.partial(_parse_expression, _id)
-                        out_collection = sorted(out_collection, key=key_getter)
-                        grouped = itertools.groupby(out_collection, key_getter)
-                    else:
-                        grouped = [(None, out_collection)]
-
-                    for doc_id, group in grouped:
-                        group_list = ([x for x in group])
-                        doc_dict = {'_id': doc_id}
-
-                        for field, value in iteritems(v):
-                            if field == '_id':
-                                continue
-                            for operator, key in iteritems(value):
-                                if operator in (
-                                        "$sum",
-                                        "$avg",
-                                        "$min",
-                                        "$max",
-                                        "$first",
-                                        "$last",
-                                        "$addToSet",
-                                        '$push'
-                                ):
-                                    key_getter = functools.partial(_parse_expression, key)
-                                    values = [key_getter(doc) for doc in group_list]
-
-                                    if operator == "$sum":
-                                        val_it = (val or 0 for val in values)
-                                        doc_dict[field] = sum(val_it)
-                                    elif operator == "$avg":
-                                        values = [val or 0 for val in values]
-                                        doc_dict[field] = sum(values) / max(len(values), 1)
-                                    elif operator == "$min":
-                                        val_it = (val or MAXSIZE for val in values)
-                                        doc_dict[field] = min(val_it)
-                                    elif operator == "$max":
-                                        val_it = (val or -MAXSIZE for val in values)
-                                        doc_dict[field] = max(val_it)
-                                    elif operator == "$first":
-                                        doc_dict[field] = values[0]
-                                    elif operator == "$last":
-                                        doc_dict[field] = values[-1]
-                                    elif operator == "$addToSet":
-                                        val_it = (val or None for val in values)
-                                        doc_dict[field] = set(val_it)
-                                    elif operator == '$push':
-                                        if field not in doc_dict:
-                                            doc_dict[field] = []
-                                        doc_dict[field].extend(values)
-                                else:
-                                    if operator in group_operators:
-                                        raise NotImplementedError(
-                                            "Although %s is a valid group operator for the "
-                                            "aggregation pipeline, it is currently not implemented "
-                                            "in Mongomock." % operator)
-                                    else:
-                                        raise NotImplementedError(
-                                            "%s is not a valid group operator for the aggregation "
-                                            "pipeline. See http://docs.mongodb.org/manual/meta/"
-                                            "aggregation-quick-reference/ for a complete list of "
-                                            "valid operators." % operator)
-
-                        grouped_collection.append(doc_dict)
-
-                    out_collection = grouped_collection
-
-                elif k == '$sort':
-                    sort_array = []
-                    for x, y in v.items():
-                        sort_array.append({x: y})
-                    for sort_pair in reversed(sort_array):
-                        for sortKey, sortDirection in sort_pair.items():
-                            out_collection = sorted(
-                                out_collection,
-                                key=lambda x: _resolve_sort_key(sortKey, x),
-                                reverse=sortDirection < 0)
-                elif k == '$skip':
-                    out_collection = out_collection[v:]
-                elif k == '$limit':
-                    out_collection = out_collection[:v]
-                elif k == '$unwind':
-                    if not isinstance(v, helpers.basestring) or v[0] != '$':
-                        raise ValueError(
-                            "$unwind failed: exception: field path references must be prefixed "
-                            "with a '$' '%s'" % v)
-                    unwound_collection = []
-                    for doc in out_collection:
-                        array_value = get_value_by_dot(doc, v[1:])
-                        if array_value in (None, []):
-                            continue
-                        elif not isinstance(array_value, list):
-                            raise TypeError(
-                                '$unwind must specify an array field, field: '
-                                '"%s", value found: %s' % (v, array_value))
-                        for field_item in array_value:
-                            unwound_collection.append(copy.deepcopy(doc))
-                            unwound_collection[-1] = set_value_by_dot(
-                                unwound_collection[-1], v[1:], field_item)
-                    out_collection = unwound_collection
-                elif k == '$project':
-                    filter_list = ['_id']
-                    for field, value in iteritems(v):
-                        if field == '_id' and not value:
-                            filter_list.remove('_id')
-                        elif value:
-                            filter_list.append(field)
-                            out_collection = _extend_collection(out_collection, field, value)
-                    out_collection = [{k: v for (k, v) in x.items() if k in filter_list}
-                                      for x in out_collection]
-                elif k == '$out':
-                    # TODO(MetrodataTeam): should leave the origin collection unchanged
-                    collection = self.database.get_collection(v)
-                    if collection.count() > 0:
-                        collection.drop()
-                    collection.insert_many(out_collection)
-                else:
-                    if k in pipeline_operators:
-                        raise NotImplementedError(
-                            "Although '%s' is a valid operator for the aggregation pipeline, it is "
-                            "currently not implemented in Mongomock." % k)
+        # The stages are chained lazily: documents are read from the
+        # collection and pulled through the stages one at a time, only the
+        # stages that need all their input ($group, $sort, $out) hold it. The
+        # first stages are run by the query itself, so they can use indexes.
+        find_kwargs, pipeline = _split_find_stages(_optimize_pipeline(pipeline))
+        if kwargs.get('explain'):
+            return self._explain_aggregate(find_kwargs, pipeline)
+
+        def _run_stages(out_collection, stages):
+            for stage in stages:
+                for k, v in iteritems(stage):
+                    if k == '$match':
+                        out_collection = _handle_match_stage(
+                            out_collection, self._compile_filter(v))
+                    elif k == '$group':
+                        out_collection = _handle_group_stage(out_collection, v)
+                    elif k == '$sort':
+                        out_collection = _handle_sort_stage(out_collection, list(v.items()))
+                    elif k == '$skip':
+                        out_collection = itertools.islice(out_collection, v, None)
+                    elif k == '$limit':
+                        out_collection = itertools.islice(out_collection, v)
+                    elif k == '$unwind':
+                        if not isinstance(v, helpers.basestring) or v[0] != '$':
+                            raise ValueError(
+                                "$unwind failed: exception: field path references must be prefixed "
+                                "with a '$' '%s'" % v)
+                        out_collection = _handle_unwind_stage(out_collection, v)
+                    elif k == '$lookup':
+                        out_collection = _handle_lookup_stage(out_collection, v)
+                    elif k == '$project':
+                        out_collection = _handle_project_stage(out_collection, v)
+                    elif k == '$out':
+                        out_collection = list(out_collection)
+                        # TODO(MetrodataTeam): should leave the origin collection unchanged
+                        collection = self.database.get_collection(v)
+                        if collection.count() > 0:
+                            collection.drop()
+                        collection.insert_many(out_collection)
                     else:
-                        raise NotImplementedError(
-                            "%s is not a valid operator for the aggregation pipeline. "
-                            "See http://docs.mongodb.org/manual/meta/aggregation-quick-reference/ "
-                            "for a complete list of valid operators." % k)
-        return CommandCursor(out_collection)
+                        if k in pipeline_operators:
+                            raise NotImplementedError(
+                                "Although '%s' is a valid operator for the aggregation pipeline, "
+                                "it is currently not implemented in Mongomock." % k)
+                        else:
+                            raise NotImplementedError(
+                                "%s is not a valid operator for the aggregation pipeline. "
+                                "See http://docs.mongodb.org/manual/meta/"
+                                "aggregation-quick-reference/ for a complete list of valid "
+                                "operators." % k)
+            return out_collection
+
+        out_collection = _run_stages(self.find(**find_kwargs), pipeline)
+        return CommandCursor(out_collection, batch_size=kwargs.get('batchSize', 0))
+
+    def _explain_aggregate(self, find_kwargs, stages):
+        """Describe a pipeline split by _split_find_stages, as the explain option does.
+
+        Only the query feeding the pipeline is run, the other stages are
+        listed as they would be run.
+        """
+        cursor_stage = {'query': find_kwargs.get('filter', {})}
+        if 'sort' in find_kwargs:
+            cursor_stage['sort'] = OrderedDict(find_kwargs['sort'])
+        if 'skip' in find_kwargs:
+            cursor_stage['skip'] = find_kwargs['skip']
+        if 'limit' in find_kwargs:
+            cursor_stage['limit'] = find_kwargs['limit']
+        query_explain = self._explain_query(
+            find_kwargs.get('filter'), find_kwargs.get('sort'),
+            skip=find_kwargs.get('skip', 0), limit=find_kwargs.get('limit'))
+        cursor_stage['queryPlanner'] = query_explain['queryPlanner']
+        cursor_stage['executionStats'] = query_explain['executionStats']
+        return {'stages': [{'$cursor': cursor_stage}] + list(stages), 'ok': 1.0}
 
     def with_options(
             self, codec_options=None, read_preference=None, write_concern=None, read_concern=None):
@@ -1668,6 +2043,32 @@ class Collection(object):
         return BulkWriteResult(bulk.execute(), True)
 
 
+def _id_key(doc_id):
+    """Get the key under which a document with the given _id is stored."""
+    if isinstance(doc_id, dict):
+        return helpers.hashdict(doc_id)
+    return doc_id
+
+
+def _projection_trie(keys):
+    """Build the trie of the dotted keys of a projection, e.g. {'a': {'b': True, 'c': True}}.
+
+    A path ending at True covers its whole subtree, even if longer keys go
+    through it.
+    """
+    trie = {}
+    for key in keys:
+        node = trie
+        key_parts = key.split('.')
+        for key_part in key_parts[:-1]:
+            node = node.setdefault(key_part, {})
+            if node is True:
+                break
+        else:
+            node[key_parts[-1]] = True
+    return trie
+
+
 def _resolve_key(key, doc):
     return next(iter(iter_key_candidates(key, doc)), NOTHING)
 
@@ -1681,74 +2082,361 @@ def _resolve_sort_key(key, doc):
     return 1, value
 
 
+def _sort_documents(documents, sort, top_k=None):
+    """Sort documents in a single pass on the composite key of a sort.
+
+    :param sort: a list of (key, direction) pairs.
+    :param top_k: if given, only the first top_k documents are returned,
+        selected with a heap instead of sorting all the documents.
+    :return: a list of the sorted documents.
+    """
+    reverse = sort[0][1] < 0
+    if len(sort) == 1:
+        sort_key = functools.partial(_resolve_sort_key, sort[0][0])
+    elif all((direction < 0) == reverse for unused_key, direction in sort):
+        def sort_key(doc):
+            return tuple(_resolve_sort_key(key, doc) for key, unused_direction in sort)
+    else:
+        reverse = False
+
+        def sort_key(doc):
+            return tuple(
+                _resolve_sort_key(key, doc) if direction >= 0
+                else helpers.ReversedKey(_resolve_sort_key(key, doc))
+                for key, direction in sort)
+
+    if top_k is None:
+        return sorted(documents, key=sort_key, reverse=reverse)
+    # nsmallest and nlargest are stable, as sorted is
+    if reverse:
+        return heapq.nlargest(top_k, documents, key=sort_key)
+    return heapq.nsmallest(top_k, documents, key=sort_key)
+
+
+def _count_examined_documents(documents, stage):
+    for document in documents:
+        stage['docsExamined'] += 1
+        yield document
+
+
+def _plan_without_stats(stage):
+    """Get a copy of an explained stage without its execution counters."""
+    plan = {key: value for key, value in iteritems(stage)
+            if key not in ('keysExamined', 'docsExamined')}
+    if 'inputStage' in plan:
+        plan['inputStage'] = _plan_without_stats(plan['inputStage'])
+    return plan
+
+
+def _sum_stage_stats(stage, counter):
+    total = 0
+    while stage:
+        total += stage.get(counter, 0)
+        stage = stage.get('inputStage')
+    return total
+
+
+def _is_stage(stage, operator, value_types=(dict,)):
+    """Check whether a pipeline stage is a single operator with a valid value."""
+    return isinstance(stage, dict) and list(stage) == [operator] and \
+        isinstance(stage[operator], value_types) and not isinstance(stage[operator], bool)
+
+
+def _optimize_pipeline(pipeline):
+    """Rewrite a pipeline to filter documents as early as possible, as MongoDB does.
+
+    A $match that follows a $sort is moved before it, and adjacent $match
+    stages are merged into a single one.
+    """
+    optimized = []
+    for stage in pipeline:
+        if _is_stage(stage, '$match'):
+            insert_at = len(optimized)
+            while insert_at and _is_stage(optimized[insert_at - 1], '$sort'):
+                insert_at -= 1
+            if insert_at and _is_stage(optimized[insert_at - 1], '$match'):
+                optimized[insert_at - 1] = {'$match': _merge_filters(
+                    optimized[insert_at - 1]['$match'], stage['$match'])}
+                continue
+            optimized.insert(insert_at, stage)
+            continue
+        optimized.append(stage)
+    return optimized
+
+
+def _merge_filters(first, second):
+    """Get a filter matching the documents that match two filters."""
+    if any(key in first for key in second):
+        return {'$and': [first, second]}
+    # keep the clauses at the top level where the indexes can see them
+    merged = dict(first)
+    merged.update(second)
+    return merged
+
+
+def _split_find_stages(pipeline):
+    """Split the first stages of a pipeline that a query can run.
+
+    A leading $match becomes the filter of the query, and a following $sort,
+    $skip and $limit become its options so that they can use the indexes and
+    sort only the top documents.
+
+    Returns the keyword arguments of the query and the remaining stages.
+    """
+    find_kwargs = {}
+    stages = list(pipeline)
+    if stages and _is_stage(stages[0], '$match'):
+        find_kwargs['filter'] = stages.pop(0)['$match']
+    if stages and _is_stage(stages[0], '$sort'):
+        find_kwargs['sort'] = list(stages.pop(0)['$sort'].items())
+    if stages and _is_stage(stages[0], '$skip', numbers.Integral) and stages[0]['$skip'] >= 0:
+        find_kwargs['skip'] = stages.pop(0)['$skip']
+    if stages and _is_stage(stages[0], '$limit', numbers.Integral) and stages[0]['$limit'] > 0:
+        find_kwargs['limit'] = stages.pop(0)['$limit']
+    return find_kwargs, stages
+
+
+def _join_values(document, field):
+    """Get the values $lookup looks up for a document.
+
+    Those are the values of its local field, or their elements for arrays,
+    and null if the field is missing.
+    """
+    values = []
+    for candidate in iter_key_candidates(field, document):
+        if candidate is NOTHING:
+            values.append(None)
+        elif isinstance(candidate, (list, tuple)):
+            values.extend(candidate)
+        else:
+            values.append(candidate)
+    return values
+
+
+def _holds_join_value(document, field, values):
+    """Check whether a field of a document holds one of the values $lookup looks up.
+
+    As in an equality query, a missing field holds null and an array holds
+    its elements.
+    """
+    for candidate in iter_key_candidates(field, document):
+        if candidate is NOTHING:
+            candidate = None
+        if candidate in values:
+            return True
+        if isinstance(candidate, (list, tuple)) and any(item in values for item in candidate):
+            return True
+    return False
+
+
+def _correlated_join_fields(let, stage):
+    """Get the fields a $lookup pipeline joins on, from its first stage.
+
+    Only a $match of the equality of a foreign field and a variable set to a
+    local field is supported: {'$match': {'$expr': {'$eq': ['$f', '$$v']}}}
+    with 'let': {'v': '$l'}.
+
+    Returns a (local field, foreign field) pair or None.
+    """
+    if not _is_stage(stage, '$match') or list(stage['$match']) != ['$expr']:
+        return None
+    expression = stage['$match']['$expr']
+    if not isinstance(expression, dict) or list(expression) != ['$eq'] or \
+            not isinstance(expression['$eq'], (list, tuple)) or len(expression['$eq']) != 2:
+        return None
+    if not all(isinstance(operand, string_types) for operand in expression['$eq']):
+        return None
+    foreign_path, variable = sorted(expression['$eq'], key=lambda operand: operand[:2] == '$$')
+    local_path = let.get(variable[2:])
+    if foreign_path[:1] != '$' or foreign_path[:2] == '$$' or variable[:2] != '$$' or \
+            not isinstance(local_path, string_types) or \
+            local_path[:1] != '$' or local_path[:2] == '$$':
+        return None
+    return local_path[1:], foreign_path[1:]
+
+
+class _SumAccumulator(object):
+    """Computes a $sum of a group, one document at a time."""
+
+    def __init__(self):
+        self._total = 0
+
+    def add(self, value):
+        self._total += value or 0
+
+    def result(self):
+        return self._total
+
+
+class _AvgAccumulator(_SumAccumulator):
+
+    def __init__(self):
+        super(_AvgAccumulator, self).__init__()
+        self._count = 0
+
+    def add(self, value):
+        super(_AvgAccumulator, self).add(value)
+        self._count += 1
+
+    def result(self):
+        return self._total / max(self._count, 1)
+
+
+class _MinAccumulator(object):
+
+    def __init__(self):
+        self._value = NOTHING
+
+    def add(self, value):
+        value = value or MAXSIZE
+        if self._value is NOTHING or value < self._value:
+            self._value = value
+
+    def result(self):
+        return self._value
+
+
+class _MaxAccumulator(_MinAccumulator):
+
+    def add(self, value):
+        value = value or -MAXSIZE
+        if self._value is NOTHING or value > self._value:
+            self._value = value
+
+
+class _FirstAccumulator(_MinAccumulator):
+
+    def add(self, value):
+        if self._value is NOTHING:
+            self._value = value
+
+
+class _LastAccumulator(_MinAccumulator):
+
+    def add(self, value):
+        self._value = value
+
+
+class _AddToSetAccumulator(object):
+
+    def __init__(self):
+        self._values = set()
+
+    def add(self, value):
+        self._values.add(value or None)
+
+    def result(self):
+        return self._values
+
+
+class _PushAccumulator(object):
+
+    def __init__(self):
+        self._values = []
+
+    def add(self, value):
+        self._values.append(value)
+
+    def result(self):
+        return self._values
+
+
+_GROUP_ACCUMULATORS = {
+    '$sum': _SumAccumulator,
+    '$avg': _AvgAccumulator,
+    '$min': _MinAccumulator,
+    '$max': _MaxAccumulator,
+    '$first': _FirstAccumulator,
+    '$last': _LastAccumulator,
+    '$addToSet': _AddToSetAccumulator,
+    '$push': _PushAccumulator,
+}
+
+
 class Cursor(object):
 
-    def __init__(self, collection, spec=None, sort=None, projection=None, skip=0, limit=0):
+    def __init__(self, collection, spec=None, sort=None, projection=None, skip=0, limit=0,
+                 batch_size=0):
         super(Cursor, self).__init__()
         self.collection = collection
         self._spec = spec
         self._sort = sort
         self._projection = projection
         self._skip = skip
-        self._factory = functools.partial(collection._get_dataset,
-                                          spec, sort, projection, dict)
         # pymongo limit defaults to 0, returning everything
         self._limit = limit if limit != 0 else None
+        self.batch_size(batch_size)
+        # the documents retrieved and not returned yet, refilled a batch at a time
+        self._data = collections.deque()
         self.rewind()
 
     def __iter__(self):
         return self
 
     def clone(self):
-        return Cursor(self.collection,
-                      self._spec, self._sort, self._projection, self._skip, self._limit)
+        return Cursor(self.collection, self._spec, self._sort, self._projection,
+                      self._skip, self._limit, self._batch_size)
+
+    def _refresh(self):
+        """Run the query if needed and retrieve the next batch of documents.
+
+        Returns the number of documents in the buffer.
+        """
+        if self._killed:
+            return len(self._data)
+        if self._batches is None:
+            self._run_query()
+        batch = next(self._batches, ())
+        self._data.extend(batch)
+        self._retrieved += len(batch)
+        if len(batch) < (self._batch_size or DEFAULT_BATCH_SIZE) or \
+                self._limit is not None and self._retrieved >= abs(self._limit):
+            self._killed = True
+        return len(self._data)
+
+    def _run_query(self):
+        """Start the query: its documents are then retrieved by _refresh."""
+        self._batches = self.collection._iter_batches(
+            self._spec, self._sort, self._projection, dict, self._skip, self._limit,
+            self._batch_size or DEFAULT_BATCH_SIZE)
 
     def __next__(self):
-        if self._skip and not self._skipped:
-            for i in range(self._skip):
-                next(self._dataset)
-            self._skipped = self._skip
-        if self._limit is not None and self._limit <= self._emitted:
+        if not self._data and not self._refresh():
             raise StopIteration()
-        if self._limit is not None:
-            self._emitted += 1
-        return {k: copy.deepcopy(v) for k, v in iteritems(next(self._dataset))}
+        return self._data.popleft()
     next = __next__
 
     def rewind(self):
-        self._dataset = self._factory()
-        self._emitted = 0
-        self._skipped = 0
+        self._batches = None
+        self._data.clear()
+        self._retrieved = 0
+        self._killed = False
+        return self
+
+    @property
+    def alive(self):
+        """Whether the cursor may return more documents."""
+        return bool(self._data) or not self._killed
+
+    @property
+    def retrieved(self):
+        """The number of documents retrieved so far."""
+        return self._retrieved
 
     def sort(self, key_or_list, direction=None):
-        if direction is None:
-            direction = 1
-        if isinstance(key_or_list, (tuple, list)):
-            for sortKey, sortDirection in reversed(key_or_list):
-                self._dataset = iter(
-                    sorted(
-                        self._dataset,
-                        key=lambda x: _resolve_sort_key(
-                            sortKey,
-                            x),
-                        reverse=sortDirection < 0))
-        else:
-            self._dataset = iter(
-                sorted(self._dataset,
-                       key=lambda x: _resolve_sort_key(key_or_list, x),
-                       reverse=direction < 0))
+        self._sort = helpers.index_list(key_or_list, direction)
+        self.rewind()
         return self
 
     def count(self, with_limit_and_skip=False):
-        arr = [x for x in self._dataset]
-        count = len(arr)
-        if with_limit_and_skip:
-            if self._skip:
-                count -= self._skip
-            if self._limit and count > self._limit:
-                count = self._limit
-        self._dataset = iter(arr)
-        return count
+        if self._batches is None:
+            if with_limit_and_skip:
+                return self.collection._count_documents(self._spec, self._skip, self._limit)
+            return self.collection._count_documents(self._spec)
+        # the cursor has already been used or sliced: count what is left
+        arr = list(self)
+        self._data.extend(arr)
+        return len(arr)
 
     def skip(self, count):
         self._skip = count
@@ -1758,18 +2446,36 @@ class Cursor(object):
         self._limit = count if count != 0 else None
         return self
 
-    def batch_size(self, count):
+    def batch_size(self, batch_size):
+        if not isinstance(batch_size, integer_types):
+            raise TypeError('batch_size must be an integer')
+        if batch_size < 0:
+            raise ValueError('batch_size must be >= 0')
+        self._batch_size = batch_size
         return self
 
     def close(self):
-        pass
+        self._data.clear()
+        self._killed = True
+
+    def explain(self):
+        """Run the query of the cursor to describe its plan and execution.
+
+        The cursor itself is left untouched.
+        """
+        return self.collection._explain_query(
+            self._spec, self._sort, self._projection, self._skip, self._limit)
 
     def distinct(self, key):
         if not isinstance(key, helpers.basestring):
             raise TypeError('cursor.distinct key must be a string')
         unique = set()
         unique_dict_vals = []
-        for x in iter(self._dataset):
+        # as in pymongo, the skip and limit of the cursor are ignored
+        documents = Cursor(
+            self.collection, self._spec, self._sort, self._projection,
+            batch_size=self._batch_size)
+        for x in documents:
             value = _resolve_key(key, x)
             if value == NOTHING:
                 continue
@@ -1786,16 +2492,37 @@ class Cursor(object):
     def __getitem__(self, index):
         if isinstance(index, slice):
             # Limit the cursor to the given slice
-            self._dataset = (x for x in list(self._dataset)[index])
+            if self._batches is not None or index.step is not None or \
+                    (index.start or 0) < 0 or (index.stop or 0) < 0:
+                arr = list(self)[index]
+                self._data.extend(arr)
+                return self
+            start = index.start or 0
+            limit = None if index.stop is None else max(index.stop - start, 0)
+            if self._limit is not None:
+                limit = max(abs(self._limit) - start, 0) if limit is None else \
+                    min(limit, abs(self._limit) - start)
+            self._skip += start
+            self._limit = limit
+            self._run_query()
+            if limit == 0:
+                self._killed = True
             return self
         elif not isinstance(index, int):
             raise TypeError("index '%s' cannot be applied to Cursor instances" % index)
         elif index < 0:
             raise IndexError('Cursor instances do not support negativeindices')
-        else:
+        elif self._batches is not None:
             arr = list(self)
-            self._dataset = iter(arr)
+            self._data.extend(arr)
             return arr[index]
+        elif self._limit is not None and index >= abs(self._limit):
+            raise IndexError('no such item for Cursor instance')
+        else:
+            # only fetch the requested document: the cursor is left untouched
+            for document in self.clone().skip(self._skip + index).limit(1).batch_size(1):
+                return document
+            raise IndexError('no such item for Cursor instance')
 
 
 def _set_updater(doc, field_name, value):
@@ -1835,10 +2562,414 @@ def _current_date_updater(doc, field_name, value):
     if isinstance(doc, dict):
         doc[field_name] = datetime.utcnow()
 
+
+def _mul_updater(doc, field_name, value):
+    if isinstance(doc, dict):
+        doc[field_name] = doc.get(field_name, 0) * value
+
+
+def _bit_updater(doc, field_name, value):
+    if isinstance(doc, dict):
+        result = doc.get(field_name, 0)
+        for operation, operand in iteritems(value):
+            if operation == 'and':
+                result &= operand
+            elif operation == 'or':
+                result |= operand
+            elif operation == 'xor':
+                result ^= operand
+            else:
+                raise WriteError(
+                    "The $bit modifier only supports 'and', 'or', and 'xor', not '%s'"
+                    % operation)
+        doc[field_name] = result
+
+
 _updaters = {
     '$set': _set_updater,
     '$unset': _unset_updater,
     '$inc': _inc_updater,
     '$max': _max_updater,
     '$min': _min_updater,
+    '$mul': _mul_updater,
+    '$bit': _bit_updater,
+}
+
+
+def _compile_update(document):
+    """Compiles an update document into a plan to apply to each matched document.
+
+    The plan is a list of functions, one per operator of the update (or a
+    single one for a replacement), called as
+    apply(collection, existing_document, spec, subdocument, was_insert) and
+    returning the subdocument found by a positional operator, if any. Field
+    paths are split and operators are looked up only once here. As when
+    updating documents one by one, errors in the update document are raised
+    only when the plan is applied.
+    """
+    if not document:
+        return [_build_replacement(document)]
+    plan = []
+    for position, (operator, value) in enumerate(iteritems(document)):
+        if operator in _update_operators:
+            plan.append(_update_operators[operator](value))
+        elif position == 0:
+            for key in document:
+                if key.startswith('$'):
+                    # can't mix modifiers with non-modifiers in update
+                    plan.append(_update_raiser(
+                        ValueError('field names cannot start with $ [{}]'.format(operator))))
+                    return plan
+            plan.append(_build_replacement(document))
+            return plan
+        else:
+            # can't mix modifiers with non-modifiers in update
+            plan.append(_update_raiser(
+                ValueError('Invalid modifier specified: {}'.format(operator))))
+            return plan
+    return plan
+
+
+def _update_paths(document):
+    """Get the paths of the fields an update document may modify, as tuples of keys.
+
+    Paths stop before array indexes and positional operators, and the empty
+    path stands for the whole document, e.g. for a replacement. Paths inside
+    other ones are left out.
+    """
+    if not document:
+        return [()]
+    paths = set()
+    for operator, fields in iteritems(document):
+        if operator not in _update_operators or not isinstance(fields, dict):
+            return [()]
+        keys = list(fields)
+        if operator == '$rename':
+            keys.extend(value for value in itervalues(fields) if isinstance(value, string_types))
+        for key in keys:
+            path = []
+            for part in key.split('.'):
+                if part.startswith('$') or part.isdigit():
+                    break
+                path.append(part)
+            paths.add(tuple(path))
+    return [path for path in paths if not any(path[:i] in paths for i in range(len(path)))]
+
+
+def _index_overlaps(index, paths):
+    """Check whether updating some paths (see _update_paths) may change the keys of an index."""
+    for field in index.fields:
+        parts = tuple(field.split('.'))
+        if any(parts[:len(path)] == path or path[:len(parts)] == parts for path in paths):
+            return True
+    return False
+
+
+def _path_snapshot(document, path):
+    """Get the value at a path of a document as a (path, value) pair.
+
+    The path stops at the first missing field, whose value is NOTHING, or at
+    the first value that is not a document.
+    """
+    value = document
+    for position, key in enumerate(path):
+        if not isinstance(value, dict):
+            return path[:position], value
+        if key not in value:
+            return path[:position + 1], NOTHING
+        value = value[key]
+    return path, value
+
+
+def _get_path_value(document, path):
+    """Get the value at a path of a document, or NOTHING if it does not exist."""
+    value = document
+    for key in path:
+        if not isinstance(value, dict) or key not in value:
+            return NOTHING
+        value = value[key]
+    return value
+
+
+def _is_same_value(first, second):
+    """Check whether two document values are the same, including their types.
+
+    Unlike ==, values of different types such as 1, 1.0 and True differ, as
+    they would be stored differently.
+    """
+    if isinstance(first, dict):
+        return isinstance(second, dict) and len(first) == len(second) and all(
+            key in second and _is_same_value(value, second[key])
+            for key, value in iteritems(first))
+    if isinstance(first, list):
+        return isinstance(second, list) and len(first) == len(second) and all(
+            _is_same_value(item, other) for item, other in zip(first, second))
+    return type(first) is type(second) and first == second
+
+
+def _restore_path_value(document, path, value):
+    """Set back the value at a path of a document, as given by _path_snapshot."""
+    if not path:
+        document.clear()
+        document.update(value)
+        return
+    parent = _get_path_value(document, path[:-1])
+    if not isinstance(parent, dict):
+        return
+    if value is NOTHING:
+        parent.pop(path[-1], None)
+    else:
+        parent[path[-1]] = value
+
+
+def _update_raiser(error):
+    def apply(unused_collection, unused_document, unused_spec, unused_subdocument,
+              unused_was_insert):
+        raise error
+    return apply
+
+
+def _field_operations(fields):
+    return [(field, field.split('.'), value) for field, value in iteritems(fields)]
+
+
+def _build_replacement(replacement):
+    def apply(collection, existing_document, spec, subdocument, unused_was_insert):
+        _id = spec.get('_id', existing_document.get('_id'))
+        existing_document.clear()
+        if _id:
+            existing_document['_id'] = _id
+        if not replacement:
+            return subdocument
+        existing_document.update(collection._internalize_dict(replacement))
+        if existing_document['_id'] != _id:
+            raise OperationFailure(
+                "The _id field cannot be changed from {0} to {1}"
+                .format(existing_document['_id'], _id))
+        return subdocument
+    return apply
+
+
+def _field_updater_builder(updater, only_on_insert=False):
+    """Returns a builder of the plan step applying updater to each field of an operator."""
+    def build(fields):
+        operations = _field_operations(fields)
+        positional = any('$' in field for field, unused_parts, unused_value in operations)
+
+        def apply(collection, existing_document, spec, subdocument, was_insert):
+            if only_on_insert and not was_insert:
+                return subdocument
+            if positional:
+                return collection._update_document_fields_positional(
+                    existing_document, operations, spec, updater, subdocument)
+            collection._update_document_fields(existing_document, operations, updater)
+            return subdocument
+        return apply
+    return build
+
+
+def _build_current_date(fields):
+    for value in itervalues(fields):
+        if value == {'$type': 'timestamp'}:
+            return _update_raiser(NotImplementedError('timestamp is not supported so far'))
+    return _field_updater_builder(_current_date_updater)(fields)
+
+
+def _operations_builder(apply_operation):
+    """Returns a builder of the plan step calling apply_operation on each field.
+
+    apply_operation is called as
+    apply_operation(collection, existing_document, spec, subdocument, operation)
+    with the (field, field_name_parts, value) operation, and returns the
+    subdocument.
+    """
+    def build(fields):
+        operations = _field_operations(fields)
+
+        def apply(collection, existing_document, spec, subdocument, unused_was_insert):
+            for operation in operations:
+                subdocument = apply_operation(
+                    collection, existing_document, spec, subdocument, operation)
+            return subdocument
+        return apply
+    return build
+
+
+class _ValueSet(object):
+    """A set of document values, checking membership by equality in constant time.
+
+    Values are stored by their hashable stand-ins (see indexes.hashable_value),
+    so e.g. equal dicts or lists are found, and the few values that cannot be
+    hashed are compared one by one.
+    """
+
+    def __init__(self, values=()):
+        self._hashed_values = set()
+        self._unhashable_values = []
+        for value in values:
+            self.add(value)
+
+    def add(self, value):
+        try:
+            self._hashed_values.add(indexes.hashable_value(value))
+        except TypeError:
+            self._unhashable_values.append(value)
+
+    def __contains__(self, value):
+        try:
+            if indexes.hashable_value(value) in self._hashed_values:
+                return True
+        except TypeError:
+            pass
+        return value in self._unhashable_values
+
+
+def _get_or_create_parent(existing_document, nested_field_list):
+    # create nested attributes if they do not exist
+    parent = existing_document
+    for field in nested_field_list[:-1]:
+        if field not in parent:
+            parent[field] = {}
+        parent = parent[field]
+    return parent
+
+
+def _add_to_set_operation(collection, existing_document, spec, subdocument, operation):
+    unused_field, nested_field_list, value = operation
+    parent = _get_or_create_parent(existing_document, nested_field_list)
+    # we're pushing a list
+    push_results = parent.get(nested_field_list[-1], [])
+    if isinstance(value, dict) and '$each' in value:
+        existing_values = _ValueSet(push_results)
+        for obj in value['$each']:
+            if obj not in existing_values:
+                existing_values.add(obj)
+                push_results.append(obj)
+    elif value not in push_results:
+        push_results.append(value)
+    parent[nested_field_list[-1]] = push_results
+    return subdocument
+
+
+def _build_pull(fields):
+    operations = _field_operations(fields)
+    # the conditions are compiled with the filter cache of the collection, on first use
+    matchers = {}
+
+    def apply(collection, existing_document, spec, subdocument, unused_was_insert):
+        for field, nested_field_list, value in operations:
+            if field not in matchers:
+                matchers[field] = _compile_pull_condition(collection, value)
+            matches = matchers[field]
+            # nested fields includes a positional element
+            # need to find that element
+            if '$' in nested_field_list:
+                if not subdocument:
+                    subdocument = collection._get_subdocument(
+                        existing_document, spec, nested_field_list)
+                parent = subdocument
+            else:
+                parent = _get_parent(existing_document, nested_field_list)
+            if not isinstance(parent, dict):
+                continue
+            arr = parent.get(nested_field_list[-1])
+            if isinstance(arr, list):
+                arr[:] = [obj for obj in arr if not matches(obj)]
+        return subdocument
+    return apply
+
+
+def _compile_pull_condition(collection, condition):
+    """Compiles the condition of a $pull into a function telling whether to pull a value."""
+    if not isinstance(condition, dict):
+        return lambda value: value == condition
+    if condition and all(
+            key.startswith('$') and key not in LOGICAL_OPERATOR_MAP
+            for key in condition):
+        # operators applied to the values themselves, e.g. {'$in': [1, 2]}
+        matcher = collection._compile_filter({'value': condition})
+        return lambda value: matcher({'value': value})
+    # a query on the documents of the array
+    matcher = collection._compile_filter(condition)
+    return lambda value: isinstance(value, dict) and matcher(value)
+
+
+def _get_parent(existing_document, nested_field_list):
+    """Gets the container of the last field of a path, or None if it does not exist."""
+    parent = existing_document
+    for field in nested_field_list[:-1]:
+        if isinstance(parent, dict):
+            parent = parent.get(field)
+        elif isinstance(parent, list) and field.isdigit() and int(field) < len(parent):
+            parent = parent[int(field)]
+        else:
+            return None
+    return parent
+
+
+def _pull_all_operation(collection, existing_document, spec, subdocument, operation):
+    unused_field, nested_field_list, value = operation
+    parent = existing_document
+    for nested_field in nested_field_list[:-1]:
+        if nested_field not in parent:
+            break
+        parent = parent[nested_field]
+
+    if nested_field_list[-1] in parent:
+        arr = parent[nested_field_list[-1]]
+        pulled_values = _ValueSet(value)
+        parent[nested_field_list[-1]] = [obj for obj in arr if obj not in pulled_values]
+    return subdocument
+
+
+def _push_operation(collection, existing_document, spec, subdocument, operation):
+    unused_field, nested_field_list, value = operation
+    # nested fields includes a positional element
+    # need to find that element
+    if len(nested_field_list) > 1 and '$' in nested_field_list:
+        if not subdocument:
+            subdocument = collection._get_subdocument(
+                existing_document, spec, nested_field_list)
+        parent = subdocument
+    else:
+        parent = _get_or_create_parent(existing_document, nested_field_list)
+
+    # we're pushing a list
+    push_results = parent.get(nested_field_list[-1], [])
+    # check to see if we have the format { '$each': [] }
+    if isinstance(value, dict) and '$each' in value:
+        push_results += list(value['$each'])
+    else:
+        push_results.append(value)
+
+    # cannot write to doc directly as it doesn't save to existing_document
+    parent[nested_field_list[-1]] = push_results
+    return subdocument
+
+
+def _rename_operation(collection, existing_document, spec, subdocument, operation):
+    unused_field, nested_field_list, new_name = operation
+    parent = existing_document
+    for field in nested_field_list[:-1]:
+        parent = parent.get(field) if isinstance(parent, dict) else None
+    if not isinstance(parent, dict) or nested_field_list[-1] not in parent:
+        return subdocument
+    value = parent.pop(nested_field_list[-1])
+    collection._update_document_single_field(
+        existing_document, new_name.split('.'), value, _set_updater)
+    return subdocument
+
+
+# Builders of the plan step of each update operator, from the operator's value.
+_update_operators = {
+    operator: _field_updater_builder(updater) for operator, updater in iteritems(_updaters)
 }
+_update_operators.update({
+    '$setOnInsert': _field_updater_builder(_set_updater, only_on_insert=True),
+    '$currentDate': _build_current_date,
+    '$addToSet': _operations_builder(_add_to_set_operation),
+    '$pull': _build_pull,
+    '$pullAll': _operations_builder(_pull_all_operation),
+    '$push': _operations_builder(_push_operation),
+    '$rename': _operations_builder(_rename_operation),
+})
@@ -1,35 +1,74 @@
+from collections import deque
+import itertools
+
+from six import integer_types
+
+
+# Number of documents in each batch when the batch size is 0, as in the first
+# batch of a MongoDB server.
+DEFAULT_BATCH_SIZE = 101
 
 
 class CommandCursor(object):
 
-    def __init__(self, collection, curser_info=None, address=None, retrieved=0):
+    def __init__(self, collection, curser_info=None, address=None, retrieved=0, batch_size=0):
         self._collection = iter(collection)
         self._id = None
         self._address = address
-        self._data = {}
+        # the documents retrieved and not returned yet, refilled a batch at a time
+        self._data = deque()
         self._retrieved = retrieved
-        self._batch_size = 0
+        self.batch_size(batch_size)
         self._killed = (self._id == 0)
+        # the first batch is computed by the command itself, so that its errors
+        # are raised by the command: the following ones are read lazily
+        self._refresh()
 
     @property
     def address(self):
         return self._address
 
     def close(self):
-        pass
+        self._data.clear()
+        self._killed = True
 
     def batch_size(self, batch_size):
+        if not isinstance(batch_size, integer_types):
+            raise TypeError('batch_size must be an integer')
+        if batch_size < 0:
+            raise ValueError('batch_size must be >= 0')
+        self._batch_size = batch_size
         return self
 
     @property
     def alive(self):
-        return True
+        return bool(self._data) or not self._killed
+
+    @property
+    def retrieved(self):
+        """The number of documents retrieved so far."""
+        return self._retrieved
+
+    def _refresh(self):
+        """Retrieve the next batch of documents and return the number of buffered ones."""
+        if self._killed:
+            return len(self._data)
+        batch_size = self._batch_size or DEFAULT_BATCH_SIZE
+        before = len(self._data)
+        self._data.extend(itertools.islice(self._collection, batch_size))
+        fetched = len(self._data) - before
+        self._retrieved += fetched
+        if fetched < batch_size:
+            self._killed = True
+        return len(self._data)
 
     def __iter__(self):
         return self
 
     def next(self):
-        return next(self._collection)
+        if not self._data and not self._refresh():
+            raise StopIteration()
+        return self._data.popleft()
 
     __next__ = next
 
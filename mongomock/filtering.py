@@ -1,4 +1,6 @@
+import collections
 from datetime import datetime
+import threading
 
 from .helpers import ObjectId, RE_TYPE
 from . import OperationFailure
@@ -15,53 +17,340 @@ def filter_applies(search_filter, document):
     This function implements MongoDB's matching strategy over documents in the find() method
     and other related scenarios (like $elemMatch)
     """
+    return compile_filter(search_filter)(document)
+
+
+def compile_filter(search_filter, cache=None):
+    """Compiles a filter into a function telling whether a document matches it.
+
+    The filter is interpreted once: keys are split, operators are looked up and
+    regular expressions are compiled only when compiling, so the returned
+    function is the one to use when matching many documents against the same
+    filter. Errors in the filter are only raised when matching a document
+    reaches them, as filter_applies does.
+
+    The compiled plans only depend on the shape of the filter (its keys and
+    operators, not its values), and are kept in an LRU cache: the cache given
+    or a module-wide one.
+    """
+    params = []
+    shape = _filter_shape(search_filter, params)
+    plan = (cache or _DEFAULT_FILTER_CACHE).get_plan(shape)
+    return lambda document: plan(document, params)
+
+
+DEFAULT_FILTER_CACHE_SIZE = 1024
+
+FilterCacheInfo = collections.namedtuple(
+    'FilterCacheInfo', ['hits', 'misses', 'max_size', 'size'])
+
+
+class FilterCache(object):
+    """A LRU cache of compiled filter plans, keyed by the shape of the filters.
+
+    :param max_size: the maximum number of plans kept, None for no limit and 0
+        to disable the cache.
+    """
+
+    def __init__(self, max_size=DEFAULT_FILTER_CACHE_SIZE):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._plans = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_plan(self, shape):
+        with self._lock:
+            plan = self._plans.pop(shape, None)
+            if plan is not None:
+                self.hits += 1
+                self._plans[shape] = plan
+                return plan
+            self.misses += 1
+        plan = _build_filter(shape)
+        if self.max_size != 0:
+            with self._lock:
+                self._plans[shape] = plan
+                while self.max_size is not None and len(self._plans) > self.max_size:
+                    self._plans.popitem(last=False)
+        return plan
+
+    def info(self):
+        """Get the hits, misses, maximum size and current size of the cache."""
+        with self._lock:
+            return FilterCacheInfo(self.hits, self.misses, self.max_size, len(self._plans))
+
+    def clear(self):
+        with self._lock:
+            self._plans.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+_DEFAULT_FILTER_CACHE = FilterCache()
+
+
+# Shapes of filters: the filters with their values replaced by their position
+# in a list of parameters. The value dependent parts of the compilation (e.g.
+# whether a $in list can be made a set) are done when computing the shape and
+# the result is part of the shape or of the parameters.
+
+
+_NOT_EXISTS = {'$exists': False}
+
+
+def _add_param(params, value):
+    params.append(value)
+    return len(params) - 1
+
+
+def _filter_shape(search_filter, params):
     if search_filter is None:
-        return True
+        return ('all',)
     elif isinstance(search_filter, ObjectId):
         search_filter = {'_id': search_filter}
+    try:
+        clause_shapes = [
+            _clause_shape(key, search, params)
+            for key, search in iteritems(search_filter) if key != '$comment']
+    except Exception as error:
+        return ('error', _add_param(params, error))
+    return ('filter', tuple(clause_shapes))
 
-    for key, search in iteritems(search_filter):
-
-        is_match = False
-
-        if (isinstance(search, dict) and
-                ('$ne' in search or search == {'$exists': False})
-                and len(iter_key_candidates(key, document)) == 0):
-            continue
-        if key == '$comment':
-            continue
-
-        for doc_val in iter_key_candidates(key, document):
-            if isinstance(search, dict):
-                is_match = all(
-                    operator_string in OPERATOR_MAP and
-                    OPERATOR_MAP[operator_string](doc_val, search_val) or
-                    operator_string == '$not' and
-                    _not_op(document, key, search_val)
-                    for operator_string, search_val in iteritems(search)
-                ) or doc_val == search
-            elif isinstance(search, RE_TYPE) and isinstance(doc_val, (string_types, list)):
-                is_match = _regex(doc_val, search)
-            elif key in LOGICAL_OPERATOR_MAP:
-                if not search:
-                    raise OperationFailure('BadValue $and/$or/$nor must be a nonempty array')
-                is_match = LOGICAL_OPERATOR_MAP[key](document, search)
-            elif isinstance(doc_val, (list, tuple)):
-                is_match = (search in doc_val or search == doc_val)
-                if isinstance(search, ObjectId):
-                    is_match |= (str(search) in doc_val)
-            else:
-                is_match = (doc_val == search) or (search is None and doc_val is NOTHING)
-
-            if is_match:
-                break
-
-        if not is_match:
-            return False
 
+def _clause_shape(key, search, params):
+    try:
+        if isinstance(search, dict):
+            pass_if_missing = '$ne' in search or search == _NOT_EXISTS
+            search_index = _add_param(params, search)
+            operator_shapes = [
+                _operator_shape(key, operator_string, search_val, params)
+                for operator_string, search_val in iteritems(search)]
+            return ('operators', key, pass_if_missing, search_index, tuple(operator_shapes))
+        if isinstance(search, RE_TYPE):
+            return ('regex', key, _add_param(params, search))
+        if key in LOGICAL_OPERATOR_MAP:
+            return ('logical', key, _logical_shape(search, params))
+        return ('value', key, isinstance(search, ObjectId), _add_param(params, search))
+    except Exception as error:
+        return ('error', _add_param(params, error))
+
+
+def _logical_shape(search, params):
+    if not search:
+        return ('empty',)
+    try:
+        subqueries = list(search)
+    except TypeError:
+        return ('raw', _add_param(params, search))
+    return ('subqueries', tuple(_filter_shape(subquery, params) for subquery in subqueries))
+
+
+def _operator_shape(key, operator_string, search_val, params):
+    try:
+        if operator_string == '$not':
+            _check_not_op(search_val)
+            return ('$not', _filter_shape({key: search_val}, params))
+        if operator_string not in OPERATOR_MAP:
+            return ('unknown',)
+        if operator_string in ('$in', '$nin') and isinstance(search_val, (list, tuple)):
+            try:
+                search_set = frozenset(search_val)
+            except TypeError:
+                search_set = None
+            return (operator_string, _add_param(params, search_val),
+                    _add_param(params, search_set))
+        if operator_string == '$regex':
+            try:
+                return ('compiled $regex', _add_param(params, re.compile(search_val)))
+            except (re.error, TypeError):
+                pass
+        if operator_string == '$elemMatch':
+            return ('$elemMatch', _filter_shape(search_val, params))
+        return ('operator', operator_string, _add_param(params, search_val))
+    except Exception as error:
+        return ('error', _add_param(params, error))
+
+
+# Building plans from shapes: a plan is a function taking a document (or a
+# document value and the document for operators) and the list of parameters.
+
+
+def _match_all(unused_document, unused_params):
     return True
 
 
+def _raiser(error):
+    """Get a plan raising an error when called, to defer errors in filters."""
+    def _raise(*unused_args):
+        raise error
+    return _raise
+
+
+def _param_raiser(shape):
+    """Get a plan raising the error kept in the parameters by an error shape."""
+    index = shape[1]
+
+    def _raise(*args):
+        raise args[-1][index]
+    return _raise
+
+
+def _deferring_errors(builder, *args):
+    try:
+        return builder(*args)
+    except Exception as error:
+        return _raiser(error)
+
+
+def _build_filter(shape):
+    if shape[0] == 'all':
+        return _match_all
+    if shape[0] == 'error':
+        return _param_raiser(shape)
+
+    clauses = [_deferring_errors(_build_clause, clause_shape) for clause_shape in shape[1]]
+    if len(clauses) == 1:
+        return clauses[0]
+
+    def _matcher(document, params):
+        for clause in clauses:
+            if not clause(document, params):
+                return False
+        return True
+    return _matcher
+
+
+def _build_clause(shape):
+    """Builds the plan of the search of one key of a filter."""
+    kind, key = shape[0], shape[1]
+    if kind == 'error':
+        return _param_raiser(shape)
+    get_candidates = compile_key_candidates(key)
+    pass_if_missing = False
+
+    if kind == 'operators':
+        pass_if_missing = shape[2]
+        value_matcher = _build_operators(key, shape[3], shape[4])
+    elif kind == 'regex':
+        value_matcher = _build_regex_search(key, shape[2])
+    elif kind == 'logical':
+        value_matcher = _build_logical_operator(key, shape[2])
+    else:
+        value_matcher = _build_value_search(key, shape[2], shape[3])
+
+    def _clause(document, params):
+        candidates = get_candidates(document)
+        if pass_if_missing and not candidates:
+            return True
+        for doc_val in candidates:
+            if value_matcher(doc_val, document, params):
+                return True
+        return False
+    return _clause
+
+
+def _build_operators(key, search_index, operator_shapes):
+    terms = [_deferring_errors(_build_operator, key, operator_shape)
+             for operator_shape in operator_shapes]
+
+    def _operators_matcher(doc_val, document, params):
+        for term in terms:
+            if not term(doc_val, document, params):
+                return doc_val == params[search_index]
+        return True
+    return _operators_matcher
+
+
+def _build_operator(key, shape):
+    kind = shape[0]
+    if kind == 'error':
+        return _param_raiser(shape)
+    if kind == '$not':
+        matcher = _build_filter(shape[1])
+        return lambda doc_val, document, params: not matcher(document, params)
+    if kind == 'unknown':
+        return lambda doc_val, document, params: False
+    if kind in ('$in', '$nin'):
+        in_op = _build_in(shape[1], shape[2])
+        if kind == '$in':
+            return in_op
+        return lambda doc_val, document, params: not in_op(doc_val, document, params)
+    if kind == 'compiled $regex':
+        index = shape[1]
+        return lambda doc_val, document, params: (
+            doc_val is not NOTHING and _regex(doc_val, params[index]))
+    if kind == '$elemMatch':
+        matcher = _build_filter(shape[1])
+        return lambda doc_val, document, params: (
+            isinstance(doc_val, list) and any(matcher(item, params) for item in doc_val))
+    operator_func = OPERATOR_MAP[shape[1]]
+    index = shape[2]
+    return lambda doc_val, document, params: operator_func(doc_val, params[index])
+
+
+def _build_in(values_index, set_index):
+    """Builds a test of whether any of the values are in a list, using a set if possible."""
+    def _in(doc_val, document, params):
+        search_val = params[values_index]
+        search_set = params[set_index]
+        if search_set is None:
+            return any(x in search_val for x in _force_list(doc_val))
+        for x in _force_list(doc_val):
+            try:
+                if x in search_set:
+                    return True
+            except TypeError:
+                if x in search_val:
+                    return True
+        return False
+    return _in
+
+
+def _build_regex_search(key, search_index):
+    value_search = _build_value_search(key, False, search_index)
+
+    def _regex_matcher(doc_val, document, params):
+        if isinstance(doc_val, (string_types, list)):
+            return _regex(doc_val, params[search_index])
+        return value_search(doc_val, document, params)
+    return _regex_matcher
+
+
+def _build_value_search(key, is_object_id, search_index):
+    if key in LOGICAL_OPERATOR_MAP:
+        return _build_logical_operator(key, ('raw', search_index))
+
+    def _value_matcher(doc_val, document, params):
+        search = params[search_index]
+        if isinstance(doc_val, (list, tuple)):
+            is_match = (search in doc_val or search == doc_val)
+            if is_object_id:
+                is_match |= (str(search) in doc_val)
+            return is_match
+        return (doc_val == search) or (search is None and doc_val is NOTHING)
+    return _value_matcher
+
+
+def _build_logical_operator(key, shape):
+    if shape[0] == 'empty':
+        return _raiser(OperationFailure('BadValue $and/$or/$nor must be a nonempty array'))
+    if shape[0] == 'raw':
+        logical_operator = LOGICAL_OPERATOR_MAP[key]
+        index = shape[1]
+        return lambda doc_val, document, params: logical_operator(document, params[index])
+
+    matchers = [_build_filter(subquery_shape) for subquery_shape in shape[1]]
+    if key == '$or':
+        return lambda doc_val, document, params: any(
+            matcher(document, params) for matcher in matchers)
+    if key == '$and':
+        return lambda doc_val, document, params: all(
+            matcher(document, params) for matcher in matchers)
+    return lambda doc_val, document, params: all(
+        not matcher(document, params) for matcher in matchers)
+
+
 def iter_key_candidates(key, doc):
     """Get possible subdocuments or lists that are referred to by the key in question
 
@@ -88,6 +377,59 @@ def iter_key_candidates(key, doc):
     return iter_key_candidates(sub_key, sub_doc)
 
 
+def compile_key_candidates(key):
+    """Compiles iter_key_candidates for a given key.
+
+    Returns a function taking a document and returning the same candidates as
+    iter_key_candidates(key, document), without splitting the key each time.
+    """
+    key_parts = key.split('.')
+    num_parts = len(key_parts)
+    int_parts = []
+    for part in key_parts:
+        try:
+            int_parts.append(int(part))
+        except ValueError:
+            int_parts.append(None)
+
+    def _candidates(doc, position):
+        if doc is None:
+            return ()
+        if position >= num_parts or (position == num_parts - 1 and not key_parts[position]):
+            return [doc]
+        if isinstance(doc, list):
+            return _sublist_candidates(doc, position)
+        if not isinstance(doc, dict):
+            return ()
+        if position == num_parts - 1:
+            return [doc.get(key_parts[position], NOTHING)]
+        return _candidates(doc.get(key_parts[position], {}), position + 1)
+
+    def _sublist_candidates(doc, position):
+        sub_key = key_parts[position]
+        sub_key_int = int_parts[position]
+        if sub_key_int is None:
+            return [x
+                    for sub_doc in doc
+                    if isinstance(sub_doc, dict) and sub_key in sub_doc
+                    for x in _candidates(sub_doc[sub_key], position + 1)]
+        if sub_key_int >= len(doc):
+            return ()  # dead end
+        sub_doc = doc[sub_key_int]
+        if position + 1 < num_parts:
+            return _candidates(sub_doc, position + 1)
+        return [sub_doc]
+
+    if num_parts == 1 and key:
+        def _top_level_candidates(doc):
+            if isinstance(doc, dict):
+                return [doc.get(key, NOTHING)]
+            return _candidates(doc, 0)
+        return _top_level_candidates
+
+    return lambda doc: _candidates(doc, 0)
+
+
 def _iter_key_candidates_sublist(key, doc):
     """Iterates of cadindates
 
@@ -134,6 +476,11 @@ def _all_op(doc_val, search_val):
 
 
 def _not_op(d, k, s):
+    _check_not_op(s)
+    return not filter_applies({k: s}, d)
+
+
+def _check_not_op(s):
     if isinstance(s, dict):
         for key in s.keys():
             if key == '$regex':
@@ -144,7 +491,6 @@ def _not_op(d, k, s):
         pass
     else:
         raise OperationFailure('BadValue $not needs a regex or a document')
-    return not filter_applies({k: s}, d)
 
 
 def _not_nothing_and(f):
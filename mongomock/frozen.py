@@ -0,0 +1,206 @@
+"""Immutable storage of documents, used with MongoClient(frozen_documents=True).
+
+Documents are stored frozen: they cannot be modified, so they never have to
+be copied to be protected from the user. Reads return copy-on-write views of
+them, that only copy the nested documents and arrays that are accessed.
+
+Values other than documents and arrays are copied when stored but then shared
+between the stored documents and the views: they must not be modified in place.
+"""
+import copy
+import sys
+
+from six import PY2
+
+from mongomock.helpers import IMMUTABLE_TYPES
+
+
+def _immutable(self, *args, **kwargs):
+    raise TypeError('%s objects are immutable' % type(self).__name__)
+
+
+class FrozenDict(dict):
+    """A stored document, or subdocument, that cannot be modified."""
+
+    __slots__ = ()
+
+    __setitem__ = __delitem__ = __ior__ = _immutable
+    clear = pop = popitem = setdefault = update = _immutable
+
+    def __copy__(self):
+        return CopyOnWriteDict(self)
+
+    def __deepcopy__(self, memo):
+        return thaw(self)
+
+    def __reduce__(self):
+        return dict, (thaw(self),)
+
+
+class FrozenList(list):
+    """A stored array that cannot be modified."""
+
+    __slots__ = ()
+
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _immutable
+    __setslice__ = __delslice__ = _immutable
+    append = extend = insert = pop = remove = reverse = sort = _immutable
+
+    def __copy__(self):
+        return CopyOnWriteList(self)
+
+    def __deepcopy__(self, memo):
+        return thaw(self)
+
+    def __reduce__(self):
+        return list, (thaw(self),)
+
+
+def freeze(value):
+    """Get an immutable copy of a value, sharing the parts that are already immutable."""
+    if isinstance(value, (FrozenDict, FrozenList)) or isinstance(value, IMMUTABLE_TYPES):
+        return value
+    if isinstance(value, dict):
+        return FrozenDict((k, freeze(v)) for k, v in dict.items(value))
+    if isinstance(value, list):
+        return FrozenList(freeze(v) for v in list.__iter__(value))
+    if isinstance(value, tuple):
+        return tuple(freeze(v) for v in value)
+    return copy.deepcopy(value)
+
+
+def thaw(value):
+    """Get a mutable deep copy of a frozen value."""
+    if isinstance(value, dict):
+        return {k: thaw(v) for k, v in dict.items(value)}
+    if isinstance(value, list):
+        return [thaw(v) for v in list.__iter__(value)]
+    if isinstance(value, tuple):
+        return tuple(thaw(v) for v in value)
+    return value
+
+
+# Before Python 3.6, dict(doc), doc.update(other) and the unpacking of
+# documents read the values of a dict subclass without calling any of its
+# methods, which would hand out frozen values: views are full copies there.
+_LAZY_VIEWS = sys.version_info >= (3, 6)
+
+
+def view(value):
+    """Get a copy-on-write view of a frozen value, to hand it out to the user."""
+    if not _LAZY_VIEWS:
+        return thaw(value)
+    if isinstance(value, FrozenDict):
+        return CopyOnWriteDict(value)
+    if isinstance(value, FrozenList):
+        return CopyOnWriteList(value)
+    return value
+
+
+_FROZEN_TYPES = (FrozenDict, FrozenList)
+
+
+class CopyOnWriteDict(dict):
+    """A mutable shallow copy of a frozen document.
+
+    Its frozen values are replaced by views of them when they are accessed, so
+    they can be modified without modifying the stored document.
+    """
+
+    __slots__ = ()
+
+    def _thaw_all(self):
+        for key, value in dict.items(self):
+            if isinstance(value, _FROZEN_TYPES):
+                dict.__setitem__(self, key, view(value))
+
+    def __getitem__(self, key):
+        value = dict.__getitem__(self, key)
+        if isinstance(value, _FROZEN_TYPES):
+            value = view(value)
+            dict.__setitem__(self, key, value)
+        return value
+
+    def __iter__(self):
+        # Overriding it makes dict(doc), other.update(doc) and {**doc} read the
+        # values with __getitem__ rather than copy the frozen ones as they are.
+        return dict.__iter__(self)
+
+    def get(self, key, default=None):
+        if key in self:
+            return self[key]
+        return default
+
+    def setdefault(self, key, default=None):
+        if key in self:
+            return self[key]
+        dict.__setitem__(self, key, default)
+        return default
+
+    def pop(self, key, *args):
+        if key in self:
+            return view(dict.pop(self, key))
+        return dict.pop(self, key, *args)
+
+    def popitem(self):
+        key, value = dict.popitem(self)
+        return key, view(value)
+
+    def values(self):
+        self._thaw_all()
+        return dict.values(self)
+
+    def items(self):
+        self._thaw_all()
+        return dict.items(self)
+
+    if PY2:
+        def itervalues(self):
+            self._thaw_all()
+            return dict.itervalues(self)
+
+        def iteritems(self):
+            self._thaw_all()
+            return dict.iteritems(self)
+
+    def copy(self):
+        return CopyOnWriteDict(self)
+
+
+class CopyOnWriteList(list):
+    """A mutable shallow copy of a frozen array, see CopyOnWriteDict."""
+
+    __slots__ = ()
+
+    def _thaw_all(self):
+        for index, value in enumerate(list.__iter__(self)):
+            if isinstance(value, _FROZEN_TYPES):
+                list.__setitem__(self, index, view(value))
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            self._thaw_all()
+            return list.__getitem__(self, index)
+        value = list.__getitem__(self, index)
+        if isinstance(value, _FROZEN_TYPES):
+            value = view(value)
+            list.__setitem__(self, index, value)
+        return value
+
+    if PY2:
+        def __getslice__(self, start, stop):
+            return self[max(0, start):max(0, stop):]
+
+    def __iter__(self):
+        self._thaw_all()
+        return list.__iter__(self)
+
+    def __reversed__(self):
+        self._thaw_all()
+        return list.__reversed__(self)
+
+    def pop(self, *args):
+        return view(list.pop(self, *args))
+
+    def copy(self):
+        return CopyOnWriteList(self)
@@ -1,7 +1,12 @@
+import collections
+from datetime import datetime
+from mongomock import InvalidDocument
 from mongomock import InvalidURI
+import numbers
 import re
 from six.moves.urllib_parse import unquote_plus
-from six import iteritems, PY2
+from six import iteritems, PY2, string_types, text_type
+import uuid
 import warnings
 
 
@@ -19,6 +24,59 @@ else:
 
 ASCENDING = 1
 
+# Types of the values that cannot be modified in place, so that they never
+# need to be copied.
+IMMUTABLE_TYPES = (
+    basestring, numbers.Number, type(None), datetime, ObjectId, RE_TYPE, uuid.UUID)
+
+
+# Types of the values that BSON can encode, besides documents, arrays,
+# integers and the types of the bson package (that have a _type_marker).
+_BSON_SCALAR_TYPES = (
+    basestring, float, type(None), datetime, ObjectId, RE_TYPE, uuid.UUID)
+# Exact types of the most common values, checked first to go faster.
+_SIMPLE_BSON_TYPES = frozenset(
+    (text_type, bytes, float, bool, type(None), datetime, ObjectId))
+_MIN_INT64 = -2 ** 63
+_MAX_INT64 = 2 ** 63 - 1
+
+
+def check_bson_document(document, check_keys=True):
+    """Check that a document could be encoded to BSON, without encoding it.
+
+    This is a lighter version of the checks of bson.BSON.encode: it raises
+    InvalidDocument for keys that are not strings (or that start with '$' or
+    contain '.' if check_keys) and for values that BSON cannot encode.
+    """
+    for key, value in iteritems(document):
+        if not isinstance(key, string_types):
+            raise InvalidDocument('documents must have only string keys, key was %r' % (key,))
+        if check_keys:
+            if key.startswith('$'):
+                raise InvalidDocument("key '%s' must not start with '$'" % key)
+            if '.' in key:
+                raise InvalidDocument("key '%s' must not contain '.'" % key)
+        if type(value) not in _SIMPLE_BSON_TYPES:
+            _check_bson_value(value, check_keys)
+
+
+def _check_bson_value(value, check_keys):
+    value_type = type(value)
+    if value_type is int:
+        if not _MIN_INT64 <= value <= _MAX_INT64:
+            raise OverflowError('BSON can only handle up to 8-byte ints')
+    elif value_type is dict or isinstance(value, collections.Mapping):
+        check_bson_document(value, check_keys)
+    elif value_type is list or isinstance(value, (list, tuple)):
+        for item in value:
+            if type(item) not in _SIMPLE_BSON_TYPES:
+                _check_bson_value(item, check_keys)
+    elif isinstance(value, numbers.Integral):
+        if not _MIN_INT64 <= value <= _MAX_INT64:
+            raise OverflowError('BSON can only handle up to 8-byte ints')
+    elif not isinstance(value, _BSON_SCALAR_TYPES) and not hasattr(value, '_type_marker'):
+        raise InvalidDocument('Cannot encode object: %r' % (value,))
+
 
 def print_deprecation_warning(old_param_name, new_param_name):
     warnings.warn(
@@ -27,6 +85,31 @@ def print_deprecation_warning(old_param_name, new_param_name):
         "purposes." % (old_param_name, new_param_name), DeprecationWarning)
 
 
+class ReversedKey(object):
+    """Wraps a sort key to reverse its order, e.g. for the descending fields of a sort."""
+
+    __slots__ = ('key',)
+
+    def __init__(self, key):
+        self.key = key
+
+    def __eq__(self, other):
+        return isinstance(other, ReversedKey) and self.key == other.key
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __lt__(self, other):
+        if not isinstance(other, ReversedKey):
+            return NotImplemented
+        return other.key < self.key
+
+    def __gt__(self, other):
+        if not isinstance(other, ReversedKey):
+            return NotImplemented
+        return self.key < other.key
+
+
 def index_list(key_or_list, direction=None):
     """Helper to generate a list of (key, direction) pairs.
 
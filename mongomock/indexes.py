@@ -0,0 +1,474 @@
+"""In-memory indexes maintained by Collection.create_index."""
+import bisect
+from collections import OrderedDict
+from datetime import datetime
+import itertools
+import numbers
+from operator import itemgetter
+
+from sentinels import NOTHING
+from six import iteritems
+from six import string_types
+
+from mongomock.filtering import iter_key_candidates
+from mongomock.helpers import ObjectId
+from mongomock.helpers import RE_TYPE
+from mongomock.helpers import ReversedKey
+
+
+def gen_index_name(keys):
+    """Generate an index name from a list of (key, direction) pairs.
+
+    Mirrors pymongo: [("a", 1), ("b", -1)] becomes "a_1_b_-1".
+    """
+    return '_'.join('%s_%s' % item for item in keys)
+
+
+def hashable_value(value):
+    """Get a hashable stand-in for a document value.
+
+    Two values that compare equal get stand-ins that compare equal, so the
+    stand-ins can be used as keys of a dict to look up equal values. Raises
+    TypeError for values that cannot be hashed at all (e.g. sets).
+    """
+    if isinstance(value, dict):
+        return ('__dict__', frozenset(
+            (k, hashable_value(v)) for k, v in iteritems(value)))
+    if isinstance(value, (list, tuple)):
+        return ('__list__', tuple(hashable_value(v) for v in value))
+    hash(value)
+    return value
+
+
+class _MaxKey(object):
+    """Compares greater than anything else: used to bound searches in sorted entries."""
+
+    # Python 2 datetimes only let other objects compare to them if they have this.
+    timetuple = None
+
+    def __eq__(self, other):
+        return self is other
+
+    def __ne__(self, other):
+        return self is not other
+
+    def __lt__(self, other):
+        return False
+
+    def __gt__(self, other):
+        return self is not other
+
+
+_MAX_KEY = _MaxKey()
+
+
+# Ranks of the types in the sort order, following the BSON comparison order:
+# see https://docs.mongodb.com/manual/reference/bson-type-comparison-order/
+_MISSING_RANK = 0
+_NULL_RANK = 1
+_NUMBER_RANK = 2
+_STRING_RANK = 3
+_OBJECT_RANK = 4
+_ARRAY_RANK = 5
+_BINARY_RANK = 6
+_OBJECT_ID_RANK = 7
+_DATE_RANK = 9
+_OTHER_RANK = 20
+
+# Values of those ranks can be compared with each other by range operators.
+_ORDERED_RANKS = (_NUMBER_RANK, _STRING_RANK, _BINARY_RANK, _OBJECT_ID_RANK, _DATE_RANK)
+
+
+def sort_key(value):
+    """Get a key to sort document values in a total order.
+
+    Values of different types are ordered by the rank of their type, so
+    comparing keys never fails even if the values cannot be compared. Values
+    of the same type are compared as Python does, except for those that cannot
+    be compared at all (e.g. dicts) which are all equal.
+    """
+    if value is NOTHING:
+        return (_MISSING_RANK,)
+    if value is None:
+        return (_NULL_RANK,)
+    if isinstance(value, numbers.Number) and not isinstance(value, complex):
+        if value != value:
+            # NaN sorts before all the other numbers
+            return (_NUMBER_RANK, float('-inf'))
+        return (_NUMBER_RANK, value)
+    if isinstance(value, string_types):
+        return (_STRING_RANK, value)
+    if isinstance(value, dict):
+        return (_OBJECT_RANK,)
+    if isinstance(value, (list, tuple)):
+        return (_ARRAY_RANK,)
+    if isinstance(value, bytes):
+        return (_BINARY_RANK, value)
+    if isinstance(value, ObjectId):
+        # the hex representation sorts as the binary one
+        return (_OBJECT_ID_RANK, str(value))
+    if isinstance(value, datetime):
+        # naive and aware datetimes cannot be compared
+        return (_DATE_RANK, value.tzinfo is not None, value)
+    return (_OTHER_RANK, type(value).__name__)
+
+
+def range_bounds(search):
+    """Get the bounds of the values a filter clause is looking for.
+
+    Returns a (lower, upper) pair where each bound is either None or a
+    (sort key, inclusive) pair, or None if the clause does not restrict the
+    values to a range of comparable values.
+    """
+    if isinstance(search, dict):
+        operators = [
+            (operator, value) for operator, value in iteritems(search)
+            if operator in ('$eq', '$gt', '$gte', '$lt', '$lte')]
+        if not operators:
+            return None
+    elif isinstance(search, (RE_TYPE, ObjectId)):
+        # a regex is not a value and an ObjectId also matches its string
+        return None
+    else:
+        operators = [('$eq', search)]
+
+    lower = upper = None
+    for operator, value in operators:
+        key = sort_key(value)
+        if key[0] not in _ORDERED_RANKS:
+            return None
+        if operator in ('$eq', '$gt', '$gte'):
+            bound = (key, operator != '$gt')
+            if lower is None or (bound[0], not bound[1]) > (lower[0], not lower[1]):
+                lower = bound
+        if operator in ('$eq', '$lt', '$lte'):
+            bound = (key, operator != '$lt')
+            if upper is None or (bound[0], bound[1]) < (upper[0], upper[1]):
+                upper = bound
+    return lower, upper
+
+
+def equality_values(search):
+    """Get the values a filter clause is looking for by equality.
+
+    Returns None if the clause cannot be answered by looking up values in an
+    index (e.g. regular expressions, ranges or negations).
+    """
+    if isinstance(search, RE_TYPE):
+        return None
+    if isinstance(search, ObjectId):
+        # the filter also matches arrays holding the id as a string
+        return [search, str(search)]
+    if not isinstance(search, dict):
+        return [search]
+    if not search:
+        return None
+    if list(search) == ['$eq']:
+        return [search['$eq']]
+    if list(search) == ['$in'] and isinstance(search['$in'], (list, tuple)):
+        return list(search['$in'])
+    if any(isinstance(key, string_types) and key.startswith('$') for key in search):
+        return None
+    return [search]
+
+
+class Index(object):
+    """An index mapping indexed values to the ids of the documents holding them.
+
+    The index keeps both a hash of the values, for equality lookups, and a
+    list of the values kept sorted, for range lookups and sorting.
+
+    The index is multikey: a document holding an array gets an entry for each
+    of its elements (and one for the array itself in the hash). A document
+    missing an indexed field is indexed as null (unless the index is sparse and
+    all the indexed fields are missing). Lookups may return more documents than
+    actually match a filter, so the filter still has to be applied to them.
+    """
+
+    def __init__(self, key, name=None, unique=False, sparse=False):
+        self.key = key
+        self.name = name or gen_index_name(key)
+        self.unique = unique
+        self.sparse = sparse
+        self.fields = [field for field, unused_direction in key]
+        self._entries = {}
+        self._keys_by_id = {}
+        # documents with values that cannot be hashed: they are returned by
+        # all the lookups so that the filter can decide
+        self._unindexable = set()
+        # Entries (sort keys, sequence number, document id) kept sorted. Only
+        # ascending and descending indexes are sorted. The first field is
+        # always stored ascending, the others relatively to the first one.
+        self.ordered = all(direction in (1, -1) for unused_field, direction in key)
+        if self.ordered:
+            self.directions = [direction * key[0][1] for unused_field, direction in key]
+        self.multikey = False
+        self._sorted = []
+        # The values of the indexed fields of each document, to answer the
+        # queries that only read those fields: see covers. Documents holding
+        # arrays in those fields cannot be rebuilt from their values.
+        self._values_by_id = {}
+        self._not_coverable = set()
+        self._field_parts = [field.split('.') for field in self.fields]
+        self._coverable = self.ordered and not self.sparse and not any(
+            field.startswith(other + '.') for field in self.fields for other in self.fields)
+
+    def information(self):
+        info = {'v': 1, 'key': list(self.key)}
+        if self.unique:
+            info['unique'] = True
+        if self.sparse:
+            info['sparse'] = True
+        return info
+
+    def document_keys(self, document):
+        """Get the index keys (tuples of hashable values) of a document."""
+        values_per_field = []
+        has_field = False
+        for field in self.fields:
+            values = set()
+            for candidate in iter_key_candidates(field, document):
+                if candidate is NOTHING:
+                    values.add(None)
+                    continue
+                has_field = True
+                values.add(hashable_value(candidate))
+                if isinstance(candidate, (list, tuple)):
+                    values.update(hashable_value(item) for item in candidate)
+            values_per_field.append(values or {None})
+        if self.sparse and not has_field:
+            return frozenset()
+        return frozenset(itertools.product(*values_per_field))
+
+    def _document_sort_keys(self, document):
+        """Get the keys of the sorted entries of a document."""
+        keys_per_field = []
+        has_field = False
+        for field, direction in zip(self.fields, self.directions):
+            keys = set()
+            candidates = iter_key_candidates(field, document)
+            if len(candidates) > 1:
+                self.multikey = True
+            for candidate in candidates:
+                if candidate is NOTHING:
+                    continue
+                has_field = True
+                if isinstance(candidate, (list, tuple)):
+                    self.multikey = True
+                    keys.update(sort_key(item) for item in candidate)
+                else:
+                    keys.add(sort_key(candidate))
+            if not keys:
+                keys.add(sort_key(NOTHING))
+            if direction < 0:
+                keys = [ReversedKey(key) for key in keys]
+            keys_per_field.append(keys)
+        if self.sparse and not has_field:
+            return ()
+        return itertools.product(*keys_per_field)
+
+    def add(self, doc_id, document, sequence_number):
+        entries = []
+        if self.ordered:
+            entries = [(keys, sequence_number, doc_id)
+                       for keys in self._document_sort_keys(document)]
+            for entry in entries:
+                bisect.insort(self._sorted, entry)
+        try:
+            keys = self.document_keys(document)
+        except TypeError:
+            self._unindexable.add(doc_id)
+            keys = ()
+        for key in keys:
+            self._entries.setdefault(key, set()).add(doc_id)
+        self._keys_by_id[doc_id] = (keys, entries)
+        if self._coverable:
+            values = self._document_values(document)
+            if values is None:
+                self._not_coverable.add(doc_id)
+            else:
+                self._values_by_id[doc_id] = values
+
+    def remove(self, doc_id):
+        self._unindexable.discard(doc_id)
+        self._not_coverable.discard(doc_id)
+        self._values_by_id.pop(doc_id, None)
+        keys, entries = self._keys_by_id.pop(doc_id, ((), ()))
+        for key in keys:
+            doc_ids = self._entries[key]
+            doc_ids.discard(doc_id)
+            if not doc_ids:
+                del self._entries[key]
+        for sort_keys, sequence_number, unused_doc_id in entries:
+            del self._sorted[bisect.bisect_left(self._sorted, (sort_keys, sequence_number))]
+
+    def update(self, doc_id, document, sequence_number):
+        self.remove(doc_id)
+        self.add(doc_id, document, sequence_number)
+
+    def clear(self):
+        self._entries.clear()
+        self._keys_by_id.clear()
+        self._unindexable.clear()
+        self._values_by_id.clear()
+        self._not_coverable.clear()
+        self._sorted = []
+
+    def _document_values(self, document):
+        """Get the values of the indexed fields of a document, or None if it cannot be rebuilt.
+
+        A document cannot be rebuilt from its values if it holds arrays, or
+        subdocuments missing an indexed field: projections keep them empty.
+        """
+        values = []
+        for field_parts in self._field_parts:
+            value = document
+            has_subdocument = False
+            for position, part in enumerate(field_parts):
+                if isinstance(value, (list, tuple)):
+                    return None
+                if position and isinstance(value, dict):
+                    has_subdocument = True
+                value = value.get(part, NOTHING) if isinstance(value, dict) else NOTHING
+            if isinstance(value, (list, tuple)) or value is NOTHING and has_subdocument:
+                return None
+            values.append(value)
+        return tuple(values)
+
+    def covers(self, fields):
+        """Check whether the index holds all the given fields of all the documents."""
+        return self._coverable and not self._not_coverable and set(fields) <= set(self.fields)
+
+    def covered_document(self, doc_id):
+        """Build a document holding only the indexed fields of a document, from their values.
+
+        The index must cover its fields: see covers.
+        """
+        document = {}
+        for field_parts, value in zip(self._field_parts, self._values_by_id[doc_id]):
+            if value is NOTHING:
+                continue
+            parent = document
+            for part in field_parts[:-1]:
+                parent = parent.setdefault(part, {})
+            parent[field_parts[-1]] = value
+        return document
+
+    def has_duplicate(self, doc_id, document):
+        """Check whether another document is indexed with the same values as a document.
+
+        Documents whose values cannot be hashed are never found as duplicates.
+        """
+        try:
+            keys = self.document_keys(document)
+        except TypeError:
+            return False
+        return any(other_id != doc_id
+                   for key in keys for other_id in self._entries.get(key, ()))
+
+    def count_equal(self, value):
+        """Count the documents whose only indexed field is or contains a value.
+
+        Returns None if the count is not known, because some documents could
+        not be indexed.
+        """
+        if self._unindexable:
+            return None
+        return len(self._entries.get((hashable_value(value),), ()))
+
+    def lookup(self, values_per_field):
+        """Get the ids of the documents that may hold the given values.
+
+        :param values_per_field: for each indexed field, a list of the values
+            looked for.
+        :return: a set of document ids or None if the values cannot be looked
+            up in this index.
+        """
+        if self.sparse and any(
+                value is None for values in values_per_field for value in values):
+            # missing fields are not indexed so they cannot be found
+            return None
+        try:
+            keys = set(itertools.product(*[
+                [hashable_value(value) for value in values]
+                for values in values_per_field]))
+        except TypeError:
+            return None
+        doc_ids = set(self._unindexable)
+        for key in keys:
+            doc_ids.update(self._entries.get(key, ()))
+        return doc_ids
+
+    def find_range(self, lower=None, upper=None):
+        """Get the positions of the sorted entries whose first field is in a range.
+
+        :param lower: None or a (sort key, inclusive) pair as returned by
+            range_bounds.
+        :param upper: None or a (sort key, inclusive) pair.
+        :return: a (start, stop) pair of positions to use with ids_between.
+        """
+        if lower is None and upper is None:
+            return 0, len(self._sorted)
+        # only values of the same type can be compared
+        type_prefix = (lower or upper)[0][:-1]
+        if lower is None:
+            start_probe = (type_prefix,)
+        else:
+            start_probe = (lower[0],) if lower[1] else (lower[0], _MAX_KEY)
+        if upper is None:
+            stop_probe = (type_prefix + (_MAX_KEY,),)
+        elif upper[0][:-1] != type_prefix:
+            return 0, 0
+        else:
+            stop_probe = (upper[0], _MAX_KEY) if upper[1] else (upper[0],)
+        start = bisect.bisect_left(self._sorted, (start_probe,))
+        stop = bisect.bisect_left(self._sorted, (stop_probe,))
+        return start, max(start, stop)
+
+    def ids_between(self, start, stop, reverse=False):
+        """Get the ids of the documents of the sorted entries between two positions.
+
+        In reverse order, the documents with equal keys are still returned in
+        their insertion order, as a stable sort would do.
+        """
+        entries = self._sorted[start:stop]
+        if not reverse:
+            return [doc_id for unused_keys, unused_sequence, doc_id in entries]
+        doc_ids = []
+        for unused_keys, same_keys in itertools.groupby(reversed(entries), itemgetter(0)):
+            doc_ids.extend(reversed([doc_id for unused_keys, unused_seq, doc_id in same_keys]))
+        return doc_ids
+
+    def explain(self, reverse=False, keys_examined=0):
+        """Describe a scan of the index as the IXSCAN stage of an explain output."""
+        if self.ordered and self.key[0][1] < 0:
+            # the entries are stored in the opposite order of the index
+            reverse = not reverse
+        return {
+            'stage': 'IXSCAN',
+            'keyPattern': OrderedDict(self.key),
+            'indexName': self.name,
+            'isMultiKey': self.multikey,
+            'isUnique': self.unique,
+            'isSparse': self.sparse,
+            'direction': 'backward' if reverse else 'forward',
+            'keysExamined': keys_examined,
+        }
+
+    def sort_direction(self, sort):
+        """Check whether the sorted entries can be used to sort documents.
+
+        :param sort: a list of (key, direction) pairs.
+        :return: None if the index cannot be used for this sort, otherwise
+            whether the entries have to be read in reverse order.
+        """
+        if not self.ordered or self.multikey or len(sort) != len(self.fields):
+            return None
+        if any(field != sort_field for field, (sort_field, unused) in zip(self.fields, sort)):
+            return None
+        sort_directions = [1 if direction >= 0 else -1 for unused, direction in sort]
+        if sort_directions == self.directions:
+            return False
+        if sort_directions == [-direction for direction in self.directions]:
+            return True
+        return None
@@ -0,0 +1,86 @@
+"""Locks protecting the documents and indexes of collections across threads."""
+import threading
+
+from six.moves import _thread
+
+
+class _LockSide(object):
+    """One side (reading or writing) of a RWLock, usable in a with statement."""
+
+    __slots__ = ('acquire', 'release')
+
+    def __init__(self, acquire, release):
+        self.acquire = acquire
+        self.release = release
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
+
+
+class RWLock(object):
+    """A lock held either by any number of readers or by a single writer.
+
+    Both sides are reentrant and the thread holding the writing side can also
+    acquire the reading side, so that writes can run queries. The other way
+    round raises RuntimeError: two readers upgrading at once would wait for
+    each other forever. Use it with `with lock.reader:` or `with lock.writer:`.
+    """
+
+    def __init__(self):
+        self._mutex = threading.Lock()
+        self._condition = threading.Condition(self._mutex)
+        # number of acquisitions of the reading side, per thread
+        self._readers = {}
+        self._writer = None
+        self._writer_count = 0
+        self.reader = _LockSide(self.acquire_read, self.release_read)
+        self.writer = _LockSide(self.acquire_write, self.release_write)
+
+    def acquire_read(self):
+        me = _thread.get_ident()
+        self._mutex.acquire()
+        try:
+            while self._writer is not None and self._writer != me:
+                self._condition.wait()
+            readers = self._readers
+            readers[me] = readers.get(me, 0) + 1
+        finally:
+            self._mutex.release()
+
+    def release_read(self):
+        me = _thread.get_ident()
+        self._mutex.acquire()
+        try:
+            readers = self._readers
+            count = readers[me] - 1
+            if count:
+                readers[me] = count
+            else:
+                del readers[me]
+                self._condition.notify_all()
+        finally:
+            self._mutex.release()
+
+    def acquire_write(self):
+        me = _thread.get_ident()
+        with self._condition:
+            if self._writer == me:
+                self._writer_count += 1
+                return
+            if me in self._readers:
+                raise RuntimeError('cannot upgrade a read lock to a write lock')
+            while self._writer is not None or self._readers:
+                self._condition.wait()
+            self._writer = me
+            self._writer_count = 1
+
+    def release_write(self):
+        with self._condition:
+            self._writer_count -= 1
+            if not self._writer_count:
+                self._writer = None
+                self._condition.notify_all()
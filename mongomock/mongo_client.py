@@ -1,4 +1,6 @@
 from .database import Database
+from .filtering import DEFAULT_FILTER_CACHE_SIZE
+from .filtering import FilterCache
 from .helpers import parse_dbase_from_uri
 import itertools
 from mongomock import ConfigurationError
@@ -11,12 +13,24 @@ class MongoClient(object):
     _CONNECTION_ID = itertools.count()
 
     def __init__(self, host=None, port=None, document_class=dict,
-                 tz_aware=False, connect=True, **kwargs):
+                 tz_aware=False, connect=True, filter_cache_size=DEFAULT_FILTER_CACHE_SIZE,
+                 frozen_documents=False, validate_bson='full', **kwargs):
         self.host = host or self.HOST
         self.port = port or self.PORT
         self._databases = {}
         self._id = next(self._CONNECTION_ID)
         self._document_class = document_class
+        # compiled filters of the queries on all the collections of this client
+        self.filter_cache = FilterCache(filter_cache_size)
+        # store documents as immutable objects, see mongomock.frozen
+        self.frozen_documents = frozen_documents
+        # how inserted documents are checked to be valid BSON: 'full' encodes
+        # them (if bson is installed), 'lightweight' only checks their keys
+        # and the types of their values, 'off' does not check them
+        if validate_bson not in ('full', 'lightweight', 'off'):
+            raise ConfigurationError(
+                "validate_bson must be 'full', 'lightweight' or 'off', not %r" % validate_bson)
+        self.validate_bson = validate_bson
 
         dbase = None
 
@@ -1,25 +1,157 @@
-import uuid
+"""A pure Python ObjectId, used when bson is not installed.
+
+It follows the layout of MongoDB's ObjectIds: 12 bytes made of a 4-byte
+timestamp in seconds, 5 random bytes drawn once per process and a 3-byte
+counter, so that new ids sort in the order they were created.
+"""
+import binascii
+import calendar
+import datetime
+import itertools
+import os
+import random
+import struct
+import time
+
+from six import binary_type
+from six import PY3
+from six import string_types
+
+
+class InvalidId(ValueError):
+    """Raised when trying to build an ObjectId from an invalid value."""
+
+
+class _UTC(datetime.tzinfo):
+
+    def utcoffset(self, dt):
+        return datetime.timedelta(0)
+
+    def dst(self, dt):
+        return datetime.timedelta(0)
+
+    def tzname(self, dt):
+        return 'UTC'
+
+
+_UTC_TZ = _UTC()
+_EPOCH = datetime.datetime(1970, 1, 1, tzinfo=_UTC_TZ)
+
+_counter = itertools.count(random.randint(0, 0xFFFFFF))
+# (pid, random bytes): the random bytes are drawn again in forked processes
+_process_random = (None, None)
+
+
+def _random_bytes():
+    global _process_random
+    pid = os.getpid()
+    if _process_random[0] != pid:
+        _process_random = (pid, os.urandom(5))
+    return _process_random[1]
 
 
 class ObjectId(object):
-    def __init__(self, id=None):
-        super(ObjectId, self).__init__()
-        if id is None:
-            self._id = uuid.uuid1()
+
+    __slots__ = ('_id',)
+
+    def __init__(self, oid=None):
+        if oid is None:
+            self._id = (
+                struct.pack('>I', int(time.time()) & 0xFFFFFFFF) + _random_bytes() +
+                struct.pack('>I', next(_counter) & 0xFFFFFF)[1:])
+        elif isinstance(oid, ObjectId):
+            self._id = oid.binary
+        elif isinstance(oid, binary_type) and len(oid) == 12:
+            self._id = oid
+        elif isinstance(oid, string_types):
+            if len(oid) != 24:
+                raise InvalidId(
+                    '%r is not a valid ObjectId, it must be a 12-byte input or a '
+                    '24-character hex string' % (oid,))
+            try:
+                self._id = binascii.unhexlify(oid)
+            except (TypeError, ValueError):
+                raise InvalidId(
+                    '%r is not a valid ObjectId, it must be a 12-byte input or a '
+                    '24-character hex string' % (oid,))
         else:
-            self._id = uuid.UUID(id)
+            raise TypeError(
+                'id must be an instance of (bytes, str, ObjectId), not %s' % type(oid))
+
+    @classmethod
+    def from_datetime(cls, generation_time):
+        """Get an ObjectId with a given generation time and zeros elsewhere.
+
+        Useful for range queries on _id: naive datetimes are taken as UTC.
+        """
+        if generation_time.utcoffset() is not None:
+            generation_time = generation_time - generation_time.utcoffset()
+        timestamp = calendar.timegm(generation_time.timetuple())
+        return cls(struct.pack('>I', int(timestamp) & 0xFFFFFFFF) + b'\x00' * 8)
+
+    @classmethod
+    def is_valid(cls, oid):
+        if not oid:
+            return False
+        try:
+            cls(oid)
+            return True
+        except (InvalidId, TypeError):
+            return False
+
+    @property
+    def binary(self):
+        return self._id
+
+    @property
+    def generation_time(self):
+        """The time the id was generated, as an aware datetime in UTC."""
+        timestamp = struct.unpack('>I', self._id[0:4])[0]
+        return _EPOCH + datetime.timedelta(seconds=timestamp)
+
+    def __getstate__(self):
+        return self._id
+
+    def __setstate__(self, value):
+        self._id = value
+
+    def __str__(self):
+        if PY3:
+            return binascii.hexlify(self._id).decode()
+        return binascii.hexlify(self._id)
+
+    def __repr__(self):
+        return "ObjectId('%s')" % self
 
     def __eq__(self, other):
-        return isinstance(other, ObjectId) and other._id == self._id
+        if isinstance(other, ObjectId):
+            return self._id == other._id
+        return NotImplemented
 
     def __ne__(self, other):
-        return not (self == other)
+        if isinstance(other, ObjectId):
+            return self._id != other._id
+        return NotImplemented
 
-    def __hash__(self):
-        return hash(self._id)
+    def __lt__(self, other):
+        if isinstance(other, ObjectId):
+            return self._id < other._id
+        return NotImplemented
 
-    def __repr__(self):
-        return 'ObjectId({0})'.format(self._id)
+    def __le__(self, other):
+        if isinstance(other, ObjectId):
+            return self._id <= other._id
+        return NotImplemented
 
-    def __str__(self):
-        return str(self._id)
+    def __gt__(self, other):
+        if isinstance(other, ObjectId):
+            return self._id > other._id
+        return NotImplemented
+
+    def __ge__(self, other):
+        if isinstance(other, ObjectId):
+            return self._id >= other._id
+        return NotImplemented
+
+    def __hash__(self):
+        return hash(self._id)
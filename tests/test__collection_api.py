@@ -3,10 +3,12 @@ import copy
 from datetime import datetime
 import platform
 import random
+import re
 import six
 from six import text_type
 import time
 from unittest import TestCase, skipIf
+import uuid
 import warnings
 
 import mongomock
@@ -283,6 +285,34 @@ class CollectionAPITest(TestCase):
         self.assertEqual(self.db.collection.count({'s': 0}), 2)
         self.assertEqual(self.db.collection.count({'s': 1}), 1)
 
+    def test__count_with_index(self):
+        self.db.collection.create_index('s')
+        self.db.collection.insert_many([
+            {'_id': 1, 's': 0},
+            {'_id': 2, 's': [0, 1]},
+            {'_id': 3, 's': 1},
+            {'_id': 4, 'a': {'s': 0}},
+        ])
+        self.assertEqual(self.db.collection.count({'s': 0}), 2)
+        self.assertEqual(self.db.collection.count({'s': 1}), 2)
+        self.assertEqual(self.db.collection.count({'s': 2}), 0)
+        self.assertEqual(self.db.collection.count({'s': None}), 1)
+        self.assertEqual(self.db.collection.count({'_id': 2}), 1)
+        self.assertEqual(self.db.collection.count({'_id': 5}), 0)
+        self.db.collection.update_one({'_id': 1}, {'$set': {'s': 1}})
+        self.assertEqual(self.db.collection.count({'s': 0}), 1)
+
+    def test__count_with_limit_and_skip(self):
+        self.db.collection.insert_many([{'_id': i, 'a': i % 2} for i in range(10)])
+        self.assertEqual(self.db.collection.count({'a': 0}, skip=2), 3)
+        self.assertEqual(self.db.collection.count({'a': 0}, limit=2), 2)
+        self.assertEqual(self.db.collection.count({'a': 0}, skip=4, limit=2), 1)
+        self.assertEqual(self.db.collection.count({'a': 0}, skip=6), 0)
+        cursor = self.db.collection.find({'a': 1}).skip(1).limit(3)
+        self.assertEqual(cursor.count(), 5)
+        self.assertEqual(cursor.count(with_limit_and_skip=True), 3)
+        self.assertEqual([3, 5, 7], [doc['_id'] for doc in cursor])
+
     def test__find_returns_cursors(self):
         collection = self.db.collection
         self.assertEqual(type(collection.find()).__name__, "Cursor")
@@ -586,6 +616,13 @@ class CollectionAPITest(TestCase):
         self.assertTrue(isinstance(ret_val, list))
         self.assertTrue(set(ret_val) == set(['larry', 'gary']))
 
+    def test__cursor_distinct_ignores_skip_and_limit(self):
+        self.db.collection.insert_many([{'_id': i, 'a': i % 3} for i in range(10)])
+        cursor = self.db.collection.find({'_id': {'$gte': 1}}).skip(8).limit(1)
+        self.assertEqual([0, 1, 2], sorted(cursor.distinct('a')))
+        # the cursor itself is left untouched
+        self.assertEqual([{'_id': 9, 'a': 0}], list(cursor))
+
     def test__cursor_count_with_limit(self):
         first = {'name': 'first'}
         second = {'name': 'second'}
@@ -635,6 +672,88 @@ class CollectionAPITest(TestCase):
         count = cursor.count()
         self.assertEqual(count, 2)
 
+    def test__cursor_getitem_slice_with_skip_and_limit(self):
+        self.db.collection.insert_many([{'_id': i} for i in range(10)])
+        cursor = self.db.collection.find().skip(2).limit(5)
+        self.assertEqual([{'_id': 4}, {'_id': 5}], list(cursor[2:4]))
+        cursor = self.db.collection.find().skip(2).limit(5)
+        self.assertEqual([5, 6], [doc['_id'] for doc in cursor[3:]])
+        cursor = self.db.collection.find().skip(2).limit(5)
+        self.assertEqual([], list(cursor[3:3]))
+
+    def test__cursor_getitem_with_skip(self):
+        self.db.collection.insert_many([{'_id': i} for i in range(10)])
+        cursor = self.db.collection.find().sort('_id', -1).skip(2).limit(3)
+        self.assertEqual({'_id': 5}, cursor[2])
+        with self.assertRaises(IndexError):
+            cursor[3]
+        self.assertEqual([7, 6, 5], [doc['_id'] for doc in cursor])
+
+    def test__cursor_negative_limit(self):
+        self.db.collection.insert_many([{'_id': i} for i in range(10)])
+        self.assertEqual([0, 1, 2], [doc['_id'] for doc in self.db.collection.find().limit(-3)])
+        self.assertEqual(
+            [8, 9], [doc['_id'] for doc in self.db.collection.find(skip=8, limit=-5)])
+        self.assertEqual(
+            [9, 8], [doc['_id'] for doc in self.db.collection.find(
+                sort=[('_id', -1)], limit=-2, batch_size=1)])
+        cursor = self.db.collection.find().skip(1).limit(-3)
+        self.assertEqual({'_id': 3}, cursor[2])
+        self.assertEqual([2, 3], [doc['_id'] for doc in cursor[1:]])
+
+    def test__cursor_skip_in_sorted_index(self):
+        self.db.collection.create_index('a')
+        self.db.collection.insert_many([{'_id': i, 'a': -i} for i in range(100)])
+        cursor = self.db.collection.find().sort('a').skip(90).limit(3)
+        self.assertEqual([9, 8, 7], [doc['_id'] for doc in cursor])
+        cursor = self.db.collection.find().sort('a').skip(90).limit(3)
+        explanation = cursor.explain()
+        self.assertEqual(3, explanation['executionStats']['nReturned'])
+        self.assertEqual(3, explanation['executionStats']['totalDocsExamined'])
+
+    def test__cursor_batch_size(self):
+        self.db.collection.insert_many([{'_id': i} for i in range(10)])
+        cursor = self.db.collection.find().batch_size(4)
+        self.assertTrue(cursor.alive)
+        self.assertEqual(0, cursor.retrieved)
+        self.assertEqual({'_id': 0}, next(cursor))
+        self.assertEqual(4, cursor.retrieved)
+        self.assertEqual([1, 2, 3, 4], [next(cursor)['_id'] for unused in range(4)])
+        self.assertEqual(8, cursor.retrieved)
+        self.assertEqual([5, 6, 7, 8, 9], [doc['_id'] for doc in cursor])
+        self.assertEqual(10, cursor.retrieved)
+        self.assertFalse(cursor.alive)
+
+        cursor = self.db.collection.find(batch_size=3, limit=6)
+        self.assertEqual(6, len(list(cursor)))
+        self.assertFalse(cursor.alive)
+
+        with self.assertRaises(TypeError):
+            self.db.collection.find().batch_size('a')
+        with self.assertRaises(ValueError):
+            self.db.collection.find().batch_size(-1)
+
+    def test__cursor_close(self):
+        self.db.collection.insert_many([{'_id': i} for i in range(10)])
+        cursor = self.db.collection.find().batch_size(2)
+        next(cursor)
+        cursor.close()
+        self.assertFalse(cursor.alive)
+        self.assertEqual([], list(cursor))
+
+    def test__aggregate_batch_size(self):
+        self.db.collection.insert_many([{'_id': i} for i in range(5)])
+        cursor = self.db.collection.aggregate([{'$match': {}}], batchSize=2)
+        self.assertTrue(cursor.alive)
+        self.assertEqual({'_id': 0}, next(cursor))
+        self.assertEqual(2, cursor.retrieved)
+        self.assertEqual([1, 2, 3, 4], [doc['_id'] for doc in cursor])
+        self.assertEqual(5, cursor.retrieved)
+        self.assertFalse(cursor.alive)
+
+        with self.assertRaises(ValueError):
+            cursor.batch_size(-1)
+
     def test__cursor_getitem_negative_index(self):
         first = {'name': 'first'}
         second = {'name': 'second'}
@@ -781,6 +900,195 @@ class CollectionAPITest(TestCase):
 
         self.assertEqual(self.db.collection.find({}).count(), 3)
 
+    def test__update_uniq_idx(self):
+        self.db.collection.create_index('value', unique=True)
+        self.db.collection.insert_many([{'_id': 1, 'value': 1}, {'_id': 2, 'value': 2}])
+
+        with self.assertRaises(mongomock.DuplicateKeyError):
+            self.db.collection.update_one({'_id': 2}, {'$set': {'value': 1, 'other': 3}})
+        with self.assertRaises(mongomock.DuplicateKeyError):
+            self.db.collection.replace_one({'_id': 2}, {'value': 1})
+        self.assertEqual(
+            [{'_id': 1, 'value': 1}, {'_id': 2, 'value': 2}], list(self.db.collection.find()))
+        self.assertEqual([{'_id': 2, 'value': 2}], list(self.db.collection.find({'value': 2})))
+
+        self.db.collection.update_one({'_id': 2}, {'$set': {'value': 3}})
+        self.db.collection.insert_one({'_id': 3, 'value': 2})
+        self.assertEqual(3, self.db.collection.count())
+
+    def test__create_uniq_idx_with_dups(self):
+        self.db.collection.insert_many([{'value': 1}, {'value': 1}])
+        with self.assertRaises(mongomock.DuplicateKeyError):
+            self.db.collection.create_index('value', unique=True)
+        self.assertEqual(['_id_'], list(self.db.collection.index_information()))
+
+    def test__create_index_information(self):
+        self.assertEqual('value_1', self.db.collection.create_index('value'))
+        self.assertEqual(
+            'sparse_idx',
+            self.db.collection.create_index(
+                [('a', 1), ('b', -1)], unique=True, sparse=True, name='sparse_idx'))
+        self.assertEqual({
+            '_id_': {'v': 1, 'key': [('_id', 1)]},
+            'value_1': {'v': 1, 'key': [('value', 1)]},
+            'sparse_idx': {
+                'v': 1, 'key': [('a', 1), ('b', -1)], 'unique': True, 'sparse': True},
+        }, self.db.collection.index_information())
+
+    def test__drop_index(self):
+        self.db.collection.create_index([('value', 1)])
+        self.db.collection.create_index('other')
+        self.db.collection.drop_index([('value', 1)])
+        self.db.collection.drop_index('other_1')
+        self.assertEqual(['_id_'], list(self.db.collection.index_information()))
+        with self.assertRaises(mongomock.OperationFailure):
+            self.db.collection.drop_index('other_1')
+
+    def test__find_in_with_unhashable_values(self):
+        self.db.collection.insert_many([
+            {'_id': 1, 'a': {'b': 1}}, {'_id': 2, 'a': [1, {'b': 2}]}, {'_id': 3, 'a': 'x'}])
+        self.assertEqual(
+            [1, 2, 3],
+            [doc['_id'] for doc in self.db.collection.find({'a': {'$in': [{'b': 1}, 1, 'x']}})])
+        self.assertEqual(
+            [1, 3], [doc['_id'] for doc in self.db.collection.find({'a': {'$nin': [{'b': 2}, 1]}})])
+
+    def test__compiled_filter(self):
+        matcher = mongomock.filtering.compile_filter(
+            {'a.b': {'$regex': '^x'}, '$or': [{'c': {'$gt': 1}}, {'c': None}]})
+        self.assertTrue(matcher({'a': {'b': 'xy'}}))
+        self.assertTrue(matcher({'a': [{'b': 'z'}, {'b': 'xa'}], 'c': 2}))
+        self.assertFalse(matcher({'a': {'b': 'xy'}, 'c': 1}))
+        self.assertFalse(matcher({'a': {'b': 'y'}}))
+
+    def test__compiled_filter_raises_when_matching(self):
+        matcher = mongomock.filtering.compile_filter({'a': 1, '$or': []})
+        self.assertFalse(matcher({'a': 2}))
+        with self.assertRaises(mongomock.OperationFailure):
+            matcher({'a': 1})
+
+    def test__find_raises_filter_errors_when_reaching_the_document(self):
+        self.db.collection.insert_many([{'_id': 1, 'a': 2}, {'_id': 2, 'a': 1}])
+        cursor = self.db.collection.find(
+            {'$or': [{'a': 2}, {'a': 1, '$or': []}]}, batch_size=1)
+        self.assertEqual({'_id': 1, 'a': 2}, next(cursor))
+        with self.assertRaises(mongomock.OperationFailure):
+            next(cursor)
+
+    def test__filter_cache(self):
+        client = mongomock.MongoClient(filter_cache_size=2)
+        collection = client.db.collection
+        collection.insert_many([{'a': 1, 'b': 'x'}, {'a': 2, 'b': 'y'}])
+
+        self.assertEqual('x', collection.find_one({'a': 1})['b'])
+        self.assertEqual('y', collection.find_one({'a': 2})['b'])
+        self.assertEqual((1, 1, 2, 1), tuple(client.filter_cache.info()))
+
+        collection.find_one({'a': {'$in': [2, 3]}})
+        collection.find_one({'b': re.compile('x')})
+        # the shape of the first query has been evicted
+        collection.find_one({'a': 3})
+        self.assertEqual((1, 4, 2, 2), tuple(client.filter_cache.info()))
+
+        self.assertEqual(
+            [2], [doc['a'] for doc in collection.find({'b': {'$regex': 'y'}})])
+        self.assertEqual(
+            [2], [doc['a'] for doc in collection.find({'b': {'$regex': '^y$'}})])
+        self.assertEqual(2, client.filter_cache.info().hits)
+
+    def test__find_with_index(self):
+        self.db.collection.create_index('value')
+        self.db.collection.insert_many([
+            {'_id': 1, 'value': 'a'},
+            {'_id': 2, 'value': ['b', 'a']},
+            {'_id': 3},
+            {'_id': 4, 'value': None},
+            {'_id': 5, 'value': {'sub': 1}},
+            {'_id': 6, 'value': 'a'},
+        ])
+
+        def find_ids(filter):
+            return [doc['_id'] for doc in self.db.collection.find(filter)]
+
+        self.assertEqual([1, 2, 6], find_ids({'value': 'a'}))
+        self.assertEqual([2], find_ids({'value': ['b', 'a']}))
+        self.assertEqual([3, 4], find_ids({'value': None}))
+        self.assertEqual([5], find_ids({'value': {'sub': 1}}))
+        self.assertEqual([1, 2, 5, 6], find_ids({'value': {'$in': ['a', {'sub': 1}]}}))
+        self.assertEqual([], find_ids({'value': {'$in': []}}))
+        self.assertEqual([6], find_ids({'value': 'a', '_id': {'$gt': 3}}))
+        self.assertEqual(3, self.db.collection.count({'value': 'a'}))
+
+    def test__index_follows_updates_and_deletes(self):
+        self.db.collection.create_index('value')
+        self.db.collection.insert_many([{'_id': i, 'value': i % 3} for i in range(1, 10)])
+
+        self.db.collection.update_many({'value': 1}, {'$set': {'value': 4}})
+        self.assertEqual(0, self.db.collection.count({'value': 1}))
+        self.assertEqual([1, 4, 7], [d['_id'] for d in self.db.collection.find({'value': 4})])
+
+        self.db.collection.replace_one({'_id': 3}, {'other': 1})
+        self.assertEqual([6, 9], [d['_id'] for d in self.db.collection.find({'value': 0})])
+
+        self.db.collection.delete_many({'value': {'$in': [0, 2]}})
+        self.assertEqual([1, 3, 4, 7], [d['_id'] for d in self.db.collection.find()])
+        self.assertEqual([3], [d['_id'] for d in self.db.collection.find({'value': None})])
+
+        self.db.collection.drop()
+        self.db.collection.insert_one({'_id': 1, 'value': 4})
+        self.assertEqual(['_id_'], list(self.db.collection.index_information()))
+        self.assertEqual(1, self.db.collection.count({'value': 4}))
+
+    def test__sparse_index_does_not_hide_missing_fields(self):
+        self.db.collection.create_index('value', sparse=True)
+        self.db.collection.insert_many([{'_id': 1}, {'_id': 2, 'value': 3}])
+        self.assertEqual([{'_id': 1}], list(self.db.collection.find({'value': None})))
+
+    def test__find_range_with_index(self):
+        self.db.collection.create_index('value')
+        self.db.collection.insert_many([
+            {'_id': 1, 'value': 5},
+            {'_id': 2, 'value': 'a'},
+            {'_id': 3, 'value': 2},
+            {'_id': 5},
+            {'_id': 6, 'value': 7.5},
+            {'_id': 7, 'value': 5},
+        ])
+        self.assertEqual(
+            [1, 3, 7],
+            [doc['_id'] for doc in self.db.collection.find({'value': {'$gte': 2, '$lte': 5}})])
+        self.assertEqual(
+            [6],
+            [doc['_id'] for doc in self.db.collection.find({'value': {'$gt': 5}})])
+        self.assertEqual(
+            [2], [doc['_id'] for doc in self.db.collection.find({'value': {'$lt': 'z'}})])
+        self.assertEqual(
+            [], list(self.db.collection.find({'value': {'$gt': 7.5, '$lt': 'z'}})))
+
+    def test__sort_with_index(self):
+        self.db.collection.create_index([('a', 1), ('b', -1)])
+        self.db.collection.insert_many([
+            {'_id': 1, 'a': 2, 'b': 1},
+            {'_id': 2, 'a': 1, 'b': 1},
+            {'_id': 3, 'a': 2, 'b': 3},
+            {'_id': 4, 'a': 1, 'b': 1},
+            {'_id': 5, 'a': 3},
+        ])
+        self.assertEqual(
+            [2, 4, 3, 1, 5],
+            [doc['_id'] for doc in self.db.collection.find().sort([('a', 1), ('b', -1)])])
+        # equal documents keep their insertion order in reverse too
+        self.assertEqual(
+            [5, 1, 3, 2, 4],
+            [doc['_id'] for doc in self.db.collection.find().sort([('a', -1), ('b', 1)])])
+        self.assertEqual(
+            [1, 3],
+            [doc['_id'] for doc in self.db.collection.find({'a': {'$gte': 2, '$lt': 3}})])
+        self.assertEqual(
+            [5, 1, 3],
+            [doc['_id'] for doc in self.db.collection.find(
+                {'a': {'$gte': 2}}, sort=[('a', -1), ('b', 1)])])
+
     def test__set_with_positional_operator(self):
         """Real mongodb support positional operator $ for $set operation"""
         base_document = {"int_field": 1,
@@ -849,6 +1157,159 @@ class CollectionAPITest(TestCase):
 
         self.assertEqual(list(self.db.collection.find()), [expected_document])
 
+    def test__find_reads_a_snapshot(self):
+        self.db.collection.insert_many([{'_id': i} for i in range(300)])
+        # documents are only read when their batch is retrieved
+        cursor = self.db.collection.find(batch_size=1)
+        self.assertEqual({'_id': 0}, next(cursor))
+        self.db.collection.insert_one({'_id': 300})
+        self.db.collection.delete_many({'_id': {'$gte': 100, '$lt': 260}})
+        self.db.collection.insert_one({'_id': 120})
+        self.assertEqual(
+            list(range(1, 100)) + list(range(260, 300)), [doc['_id'] for doc in cursor])
+        self.assertEqual(
+            list(range(100)) + list(range(260, 301)) + [120],
+            [doc['_id'] for doc in self.db.collection.find()])
+
+    def test__explain(self):
+        self.db.collection.insert_many([{'_id': i, 'a': i % 5, 'b': i} for i in range(20)])
+        explain = self.db.collection.find({'b': {'$lt': 5}}).explain()
+        self.assertEqual('COLLSCAN', explain['queryPlanner']['winningPlan']['stage'])
+        self.assertNotIn('docsExamined', explain['queryPlanner']['winningPlan'])
+        self.assertEqual(5, explain['executionStats']['nReturned'])
+        self.assertEqual(20, explain['executionStats']['totalDocsExamined'])
+        self.assertEqual(0, explain['executionStats']['totalKeysExamined'])
+
+        self.db.collection.create_index('a')
+        cursor = self.db.collection.find({'a': 3, 'b': {'$gt': 5}}).sort('b', -1).limit(1)
+        explain = cursor.explain()
+        plan = explain['queryPlanner']['winningPlan']
+        self.assertEqual('LIMIT', plan['stage'])
+        self.assertEqual('SORT', plan['inputStage']['stage'])
+        self.assertEqual('FETCH', plan['inputStage']['inputStage']['stage'])
+        index_scan = plan['inputStage']['inputStage']['inputStage']
+        self.assertEqual('IXSCAN', index_scan['stage'])
+        self.assertEqual('a_1', index_scan['indexName'])
+        self.assertEqual(1, explain['executionStats']['nReturned'])
+        self.assertEqual(4, explain['executionStats']['totalKeysExamined'])
+        self.assertEqual(4, explain['executionStats']['totalDocsExamined'])
+        # the cursor can still be used
+        self.assertEqual([{'_id': 18, 'a': 3, 'b': 18}], list(cursor))
+
+        explain = self.db.collection.aggregate([
+            {'$match': {'a': 3}},
+            {'$group': {'_id': None, 'count': {'$sum': 1}}},
+        ], explain=True)
+        cursor_stage = explain['stages'][0]['$cursor']
+        self.assertEqual({'a': 3}, cursor_stage['query'])
+        self.assertEqual(4, cursor_stage['executionStats']['nReturned'])
+        self.assertEqual(
+            [{'$group': {'_id': None, 'count': {'$sum': 1}}}], explain['stages'][1:])
+
+    def test__covered_query(self):
+        self.db.collection.create_index([('a', 1), ('b.c', -1)])
+        self.db.collection.insert_many([
+            {'_id': i, 'a': i % 3, 'b': {'c': i, 'd': i}, 'e': i} for i in range(12)])
+        self.db.collection.insert_one({'_id': 12, 'e': 12})
+
+        cursor = self.db.collection.find(
+            {'a': 1, 'b.c': {'$gt': 3}}, {'_id': 0, 'b.c': 1}).sort('b.c', -1)
+        self.assertEqual([{'b': {'c': 10}}, {'b': {'c': 7}}, {'b': {'c': 4}}], list(cursor))
+        explain = cursor.explain()
+        plan = explain['queryPlanner']['winningPlan']
+        self.assertEqual('PROJECTION_COVERED', plan['stage'])
+        self.assertEqual('SORT', plan['inputStage']['stage'])
+        self.assertEqual('IXSCAN', plan['inputStage']['inputStage']['stage'])
+        self.assertEqual(0, explain['executionStats']['totalDocsExamined'])
+
+        cursor = self.db.collection.find(
+            {}, {'a': 1, '_id': 0}, sort=[('a', 1), ('b.c', -1)], limit=3)
+        self.assertEqual([{}, {'a': 0}, {'a': 0}], list(cursor))
+        explain = cursor.explain()
+        plan = explain['queryPlanner']['winningPlan']
+        self.assertEqual('LIMIT', plan['stage'])
+        self.assertEqual('PROJECTION_COVERED', plan['inputStage']['stage'])
+        self.assertEqual('IXSCAN', plan['inputStage']['inputStage']['stage'])
+
+        # the _id is not in the index
+        cursor = self.db.collection.find({'a': 2}, ['a'])
+        self.assertEqual([{'_id': i, 'a': 2} for i in (2, 5, 8, 11)], list(cursor))
+        explain = cursor.explain()
+        self.assertEqual('PROJECTION', explain['queryPlanner']['winningPlan']['stage'])
+
+    def test__covered_query_keeps_the_natural_order(self):
+        self.db.collection.insert_many([
+            {'_id': 1, 'a': 3, 'b': 1}, {'_id': 2, 'a': 1, 'b': 0}, {'_id': 3, 'a': 2, 'b': 0}])
+        queries = [
+            lambda: self.db.collection.find({}, {'a': 1, '_id': 0}),
+            lambda: self.db.collection.find({}, {'a': 1, '_id': 0}).skip(1).limit(1),
+            lambda: self.db.collection.find({}, {'a': 1, 'b': 1, '_id': 0}).sort('b', 1),
+        ]
+        expected = [list(query()) for query in queries]
+        self.assertEqual([{'a': 3}, {'a': 1}, {'a': 2}], expected[0])
+
+        self.db.collection.create_index([('a', 1), ('b', 1)])
+        self.assertEqual(expected, [list(query()) for query in queries])
+        self.assertEqual(0, queries[0]().explain()['executionStats']['totalDocsExamined'])
+
+    def test__covered_query_needs_an_index_without_arrays(self):
+        self.db.collection.create_index([('a', 1), ('b', 1)])
+        self.db.collection.insert_many([{'_id': 1, 'a': 1, 'b': 1}, {'_id': 2, 'a': 1, 'b': 2}])
+        explain = self.db.collection.find({'a': 1}, {'_id': 0, 'b': 1}).explain()
+        self.assertEqual('PROJECTION_COVERED', explain['queryPlanner']['winningPlan']['stage'])
+
+        self.db.collection.insert_one({'_id': 3, 'a': 1, 'b': [3, 4]})
+        self.assertEqual(
+            [{'b': 1}, {'b': 2}, {'b': [3, 4]}],
+            list(self.db.collection.find({'a': 1}, {'_id': 0, 'b': 1})))
+        explain = self.db.collection.find({'a': 1}, {'_id': 0, 'b': 1}).explain()
+        self.assertEqual('PROJECTION', explain['queryPlanner']['winningPlan']['stage'])
+
+        self.db.collection.delete_one({'_id': 3})
+        self.db.collection.update_one({'_id': 2}, {'$set': {'b': 5}})
+        self.assertEqual(
+            [{'b': 1}, {'b': 5}], list(self.db.collection.find({'a': 1}, {'_id': 0, 'b': 1})))
+        explain = self.db.collection.find({'a': 1}, {'_id': 0, 'b': 1}).explain()
+        self.assertEqual('PROJECTION_COVERED', explain['queryPlanner']['winningPlan']['stage'])
+
+    def test__covered_query_needs_an_index_without_empty_subdocuments(self):
+        self.db.collection.create_index([('a', 1), ('b.c', -1)])
+        self.db.collection.insert_many([
+            {'_id': 1, 'a': 1, 'b': {'c': None, 'd': 1}}, {'_id': 2, 'a': 1, 'b': 5},
+            {'_id': 3, 'a': 1}])
+        projection = {'a': 1, 'b.c': 1, '_id': 0}
+        explain = self.db.collection.find({'a': 1}, projection).explain()
+        self.assertEqual('PROJECTION_COVERED', explain['queryPlanner']['winningPlan']['stage'])
+
+        # the subdocument is kept in the projection, but is not in the index
+        self.db.collection.insert_one({'_id': 4, 'a': 1, 'b': {'d': 2}})
+        self.assertEqual(
+            [{'a': 1, 'b': {'c': None}}, {'a': 1}, {'a': 1}, {'a': 1, 'b': {}}],
+            list(self.db.collection.find({'a': 1}, projection)))
+        explain = self.db.collection.find({'a': 1}, projection).explain()
+        self.assertEqual('PROJECTION', explain['queryPlanner']['winningPlan']['stage'])
+
+    def test__sort_with_limit(self):
+        self.db.collection.insert_many([
+            {'_id': 1, 'a': 2, 'b': 1},
+            {'_id': 2, 'a': 1, 'b': 1},
+            {'_id': 3, 'a': 2, 'b': 3},
+            {'_id': 4},
+            {'_id': 5, 'a': 2, 'b': 3},
+            {'_id': 6, 'a': 3, 'b': 2},
+        ])
+        cursor = self.db.collection.find().sort([('a', -1), ('b', 1)])
+        self.assertEqual([6, 1, 3], [doc['_id'] for doc in cursor.limit(3)])
+        self.assertEqual(
+            [3, 5, 2],
+            [doc['_id'] for doc in self.db.collection.find(
+                sort=[('a', -1), ('b', 1)], skip=2, limit=3)])
+        self.assertEqual(
+            [4, 2], [doc['_id'] for doc in self.db.collection.find().sort('a').limit(2)])
+        self.assertEqual(
+            [3, 5], [doc['_id'] for doc in self.db.collection.find().sort('b', -1).limit(2)])
+        self.assertEqual(6, self.db.collection.find().sort('a').limit(2).count())
+
     @skipIf(not _HAVE_PYMONGO, "pymongo not installed")
     def test__find_and_modify_with_sort(self):
         self.db.collection.insert({"time_check": float(time.time())})
@@ -890,6 +1351,94 @@ class CollectionAPITest(TestCase):
         self.assertEqual(len(test_data["test"]), 1)
         self.assertEqual(len(data_in_db["test"]), 2)
 
+    def test__add_to_set_each_with_documents_and_lists(self):
+        self.db.collection.insert({'_id': 1, 'a': [1, {'b': 2}, [3]]})
+        self.db.collection.update_one({'_id': 1}, {'$addToSet': {'a': {'$each': [
+            {'b': 2}, 4, [3], {'b': 5}, 4, {'b': 5}, set([6]), set([6])]}}})
+        self.assertEqual(
+            [1, {'b': 2}, [3], 4, {'b': 5}, set([6])],
+            self.db.collection.find_one()['a'])
+
+    def test__pull_adjacent_values(self):
+        self.db.collection.insert({'_id': 1, 'a': [1, 2, 2, 2, 3, 2], 'b': [{'c': 1}, {'c': 1}]})
+        self.db.collection.update_one({'_id': 1}, {'$pull': {'a': 2, 'b': {'c': 1}}})
+        self.assertEqual({'_id': 1, 'a': [1, 3], 'b': []}, self.db.collection.find_one())
+
+    def test__pull_with_operators_on_values(self):
+        self.db.collection.insert({'_id': 1, 'a': [1, 5, 2, 8, 3], 'b': ['x', 'y', 'z']})
+        self.db.collection.update_one(
+            {'_id': 1}, {'$pull': {'a': {'$gte': 5}, 'b': {'$in': ['x', 'z']}}})
+        self.assertEqual({'_id': 1, 'a': [1, 2, 3], 'b': ['y']}, self.db.collection.find_one())
+
+    def test__pull_with_conditions_on_nested_paths(self):
+        self.db.collection.insert({'_id': 1, 'a': [{'b': [{'c': 1, 'd': {'e': 2}}, {'c': 2}]}]})
+        self.db.collection.update_one(
+            {'_id': 1}, {'$pull': {'a.0.b': {'$or': [{'d.e': 2}, {'c': 3}]}}})
+        self.assertEqual({'_id': 1, 'a': [{'b': [{'c': 2}]}]}, self.db.collection.find_one())
+
+    def test__pull_modified_count(self):
+        self.db.collection.insert_many([{'_id': 1, 'a': [1, 2]}, {'_id': 2, 'a': [3]}])
+        result = self.db.collection.update_many({}, {'$pull': {'a': 2}})
+        self.assertEqual(2, result.matched_count)
+        self.assertEqual(1, result.modified_count)
+
+    def test__update_modified_count_of_nested_fields(self):
+        self.db.collection.insert_many([
+            {'_id': 1, 'a': {'b': 1}}, {'_id': 2, 'a': {'b': 2}}, {'_id': 3, 'a': 4}, {'_id': 4}])
+        result = self.db.collection.update_many({}, {'$set': {'a.b': 2}})
+        self.assertEqual(4, result.matched_count)
+        self.assertEqual(2, result.modified_count)
+        result = self.db.collection.update_many({'a': 4}, {'$unset': {'a.c': 1, 'e': 1}})
+        self.assertEqual(0, result.modified_count)
+        result = self.db.collection.update_many({}, {'$rename': {'a.b': 'c'}})
+        self.assertEqual(3, result.modified_count)
+        self.assertEqual(
+            [{'_id': 1, 'a': {}, 'c': 2}, {'_id': 2, 'a': {}, 'c': 2}, {'_id': 3, 'a': 4},
+             {'_id': 4, 'a': {}, 'c': 2}],
+            list(self.db.collection.find()))
+
+        # equal values of another type modify the document
+        self.db.collection.insert_one({'_id': 5, 'x': True, 'y': 1.0, 'z': {'w': [1]}})
+        for update, modified_count in [
+                ({'x': 1}, 1), ({'y': 1}, 1), ({'z': {'w': [1.0]}}, 1), ({'z.w': [1.0]}, 0)]:
+            result = self.db.collection.update_one({'_id': 5}, {'$set': update})
+            self.assertEqual(modified_count, result.modified_count, update)
+        self.assertIs(int, type(self.db.collection.find_one({'_id': 5})['x']))
+
+    def test__update_only_updates_the_indexes_of_modified_fields(self):
+        self.db.collection.create_index('a.b')
+        self.db.collection.create_index('c')
+        self.db.collection.insert_many([{'_id': i, 'a': {'b': i}, 'c': i} for i in range(3)])
+        updated = []
+        for index in self.db.collection._indexes.values():
+            index.update = lambda doc_id, *args, **kwargs: updated.append(doc_id)
+        self.db.collection.update_many({}, {'$inc': {'d': 1}})
+        self.assertEqual([], updated)
+
+        del self.db.collection._indexes['c_1'].update
+        self.db.collection.update_many({'c': {'$gte': 1}}, {'$inc': {'c': 10}})
+        self.assertEqual([], updated)
+        self.assertEqual(
+            [1, 2], [doc['_id'] for doc in self.db.collection.find({'c': {'$gt': 10}})])
+
+        del self.db.collection._indexes['a.b_1'].update
+        self.db.collection.update_one({'_id': 0}, {'$set': {'a': {'b': 5}}})
+        self.assertEqual([0], [doc['_id'] for doc in self.db.collection.find({'a.b': 5})])
+
+    def test__update_duplicate_key_restores_nested_fields(self):
+        self.db.collection.create_index('a.b', unique=True)
+        self.db.collection.insert_many([{'_id': 1, 'a': {'b': 1}}, {'_id': 2, 'c': [1]}])
+        with self.assertRaises(mongomock.DuplicateKeyError):
+            self.db.collection.update_one(
+                {'_id': 2}, {'$set': {'a.b': 1, 'd': 1}, '$push': {'c': 2}})
+        self.assertEqual({'_id': 2, 'c': [1]}, self.db.collection.find_one({'_id': 2}))
+        self.assertEqual([2], [doc['_id'] for doc in self.db.collection.find({'a.b': None})])
+
+    def test__pull_all_with_documents_and_lists(self):
+        self.db.collection.insert({'_id': 1, 'a': [1, {'b': 2}, [3], 4, {'b': 2}, 1.0]})
+        self.db.collection.update_one({'_id': 1}, {'$pullAll': {'a': [1, {'b': 2}, [3]]}})
+        self.assertEqual([4], self.db.collection.find_one()['a'])
+
     def test__filter_with_ne(self):
         self.db.collection.insert({"_id": 1, "test_list": [{"data": "val"}]})
         data_in_db = self.db.collection.find(
@@ -910,6 +1459,31 @@ class CollectionAPITest(TestCase):
         expect = [{'_id': 1, 'list': [{"index": 1}, {"index": 2}]}]
         self.assertEqual(expect, list(actual))
 
+    def test_find_project_several_fields_in_array(self):
+        self.db.collection.insert({'_id': 1, 'a': [
+            {'b': {'c': 1, 'd': 2}, 'e': 3, 'f': 4},
+            {'b': {'c': 5}},
+            {'f': 6},
+            7,
+        ]})
+        actual = self.db.collection.find(projection=['a.b.c', 'a.e'])
+        expect = [{'_id': 1, 'a': [{'b': {'c': 1}, 'e': 3}, {'b': {'c': 5}}]}]
+        self.assertEqual(expect, list(actual))
+
+    def test_find_exclude_fields_in_array(self):
+        self.db.collection.insert({'_id': 1, 'a': [{'b': 1, 'c': 2}, {'c': 3}, 4], 'd': {'e': 5}})
+        actual = self.db.collection.find(projection={'a.b': 0, 'd.e': 0, '_id': 0})
+        self.assertEqual([{'a': [{'c': 2}, {'c': 3}, 4], 'd': {}}], list(actual))
+
+    def test_find_projection_is_not_modified(self):
+        self.db.collection.insert({'_id': 1, 'a': [{'x': 1}, {'x': 2}], 'b': 3})
+        projection = {'_id': 0, 'a': {'$elemMatch': {'x': 2}}, 'b': 1}
+        self.assertEqual(
+            [{'a': [{'x': 2}], 'b': 3}], list(self.db.collection.find(projection=projection)))
+        self.assertEqual({'_id': 0, 'a': {'$elemMatch': {'x': 2}}, 'b': 1}, projection)
+        with self.assertRaises(ValueError):
+            list(self.db.collection.find(projection={'a': 1, 'b': 0}))
+
     def test__with_options(self):
         self.db.collection.with_options(read_preference=None)
 
@@ -926,6 +1500,40 @@ class CollectionAPITest(TestCase):
             self.db.collection.update_one(
                 {}, {'$currentDate': {'updated_at': {'$type': 'timestamp'}}}, upsert=True)
 
+    def test__update_mul(self):
+        self.db.collection.insert({'_id': 1, 'a': 3, 'b': {'c': 2}})
+        self.db.collection.update_one({'_id': 1}, {'$mul': {'a': 4, 'b.c': 0.5, 'd': 2}})
+        self.assertEqual(
+            {'_id': 1, 'a': 12, 'b': {'c': 1}, 'd': 0}, self.db.collection.find_one())
+
+    def test__update_bit(self):
+        self.db.collection.insert({'_id': 1, 'a': 13, 'b': 1})
+        self.db.collection.update_one({'_id': 1}, {'$bit': {'a': {'and': 10}, 'b': {'or': 4}}})
+        self.assertEqual({'_id': 1, 'a': 8, 'b': 5}, self.db.collection.find_one())
+        with self.assertRaises(mongomock.WriteError):
+            self.db.collection.update_one({'_id': 1}, {'$bit': {'a': {'not': 1}}})
+
+    def test__update_rename(self):
+        self.db.collection.insert({'_id': 1, 'a': 1, 'b': {'c': 2}})
+        self.db.collection.update_one(
+            {'_id': 1}, {'$rename': {'a': 'x', 'b.c': 'y.z', 'missing': 'w'}})
+        self.assertEqual(
+            {'_id': 1, 'x': 1, 'b': {}, 'y': {'z': 2}}, self.db.collection.find_one())
+
+    def test__update_many_applies_the_same_plan_to_each_document(self):
+        self.db.collection.insert_many([{'_id': i, 'a': [i]} for i in range(3)])
+        self.db.collection.update_many(
+            {}, {'$inc': {'n': 1}, '$push': {'a': 9}, '$setOnInsert': {'new': True}})
+        self.assertEqual(
+            [{'_id': i, 'a': [i, 9], 'n': 1} for i in range(3)],
+            list(self.db.collection.find(sort=[('_id', 1)])))
+
+    def test__update_invalid_modifier_only_raises_on_matched_documents(self):
+        self.db.collection.update({'_id': 1}, {'$set': {'a': 1}, 'b': 2})
+        self.db.collection.insert({'_id': 1})
+        with self.assertRaises(ValueError):
+            self.db.collection.update({'_id': 1}, {'$set': {'a': 1}, 'b': 2})
+
     def test__rename_collection(self):
         self.db.collection.insert({"_id": 1, "test_list": [{"data": "val"}]})
         coll = self.db.collection
@@ -1242,6 +1850,160 @@ class CollectionAPITest(TestCase):
 
         self.assertEqual(expect, actual)
 
+    def test__aggregate_group(self):
+        self.db.collection.insert_many([
+            {'_id': 1, 'a': 'x', 'b': {'c': 1}, 'v': 3},
+            {'_id': 2, 'a': 1, 'b': {'c': 1}, 'v': 1},
+            {'_id': 3, 'a': 'x', 'b': {'c': 2}, 'v': 2},
+            {'_id': 4, 'a': 1, 'b': {'c': 1}, 'v': 5},
+        ])
+        actual = self.db.collection.aggregate([{'$group': {
+            '_id': '$a',
+            'total': {'$sum': '$v'},
+            'avg': {'$avg': '$v'},
+            'min': {'$min': '$v'},
+            'max': {'$max': '$v'},
+            'first': {'$first': '$_id'},
+            'last': {'$last': '$_id'},
+            'all': {'$push': '$v'},
+        }}])
+        self.assertEqual([
+            {'_id': 'x', 'total': 5, 'avg': 2.5, 'min': 2, 'max': 3,
+             'first': 1, 'last': 3, 'all': [3, 2]},
+            {'_id': 1, 'total': 6, 'avg': 3, 'min': 1, 'max': 5,
+             'first': 2, 'last': 4, 'all': [1, 5]},
+        ], list(actual))
+
+        actual = self.db.collection.aggregate([
+            {'$group': {'_id': {'b': '$b'}, 'ids': {'$addToSet': '$a'}}},
+        ])
+        self.assertEqual([
+            {'_id': {'b': {'c': 1}}, 'ids': {'x', 1}},
+            {'_id': {'b': {'c': 2}}, 'ids': {'x'}},
+        ], list(actual))
+
+        actual = self.db.collection.aggregate([
+            {'$match': {'a': 'y'}},
+            {'$group': {'_id': None, 'total': {'$sum': '$v'}}},
+        ])
+        self.assertEqual([], list(actual))
+
+    def test__aggregate_limit_stops_reading(self):
+        self.db.collection.insert_many([
+            {'_id': 1, 'a': [1, 2]},
+            {'_id': 2, 'a': 'not an array'},
+        ])
+        actual = self.db.collection.aggregate([
+            {'$unwind': '$a'},
+            {'$skip': 1},
+            {'$limit': 1},
+            {'$project': {'b': '$a'}},
+        ])
+        self.assertEqual([{'_id': 1, 'b': 2}], list(actual))
+
+        # the first batch is computed by aggregate, so its errors are raised there
+        with self.assertRaises(TypeError):
+            self.db.collection.aggregate([{'$unwind': '$a'}])
+
+        # the other documents are only read when their batch is retrieved
+        actual = self.db.collection.aggregate([{'$unwind': '$a'}], batchSize=1)
+        self.assertEqual(1, actual.retrieved)
+        self.assertEqual({'_id': 1, 'a': 1}, next(actual))
+        self.assertEqual({'_id': 1, 'a': 2}, next(actual))
+        with self.assertRaises(TypeError):
+            next(actual)
+
+    def test__aggregate_match_and_sort_use_the_query(self):
+        self.db.collection.create_index('a')
+        self.db.collection.insert_many([
+            {'_id': i, 'a': i % 3, 'b': -i} for i in range(1, 10)])
+        actual = self.db.collection.aggregate([
+            {'$sort': {'b': 1}},
+            {'$match': {'a': {'$gte': 1}}},
+            {'$match': {'a': {'$lt': 2}}},
+            {'$match': {'b': {'$lt': 0}}},
+            {'$skip': 1},
+            {'$limit': 2},
+            {'$project': {'_id': True}},
+        ])
+        self.assertEqual([{'_id': 4}, {'_id': 1}], list(actual))
+
+    def test__aggregate_lookup(self):
+        self.db.orders.insert_many([
+            {'_id': 1, 'item': 'a'},
+            {'_id': 2, 'item': ['b', 'c']},
+            {'_id': 3},
+        ])
+        self.db.items.insert_many([
+            {'_id': 10, 'sku': 'c'},
+            {'_id': 11, 'sku': ['a', 'b']},
+            {'_id': 12, 'sku': 'a'},
+            {'_id': 13},
+        ])
+        expected = [
+            {'_id': 1, 'item': 'a', 'stock': [
+                {'_id': 11, 'sku': ['a', 'b']}, {'_id': 12, 'sku': 'a'}]},
+            {'_id': 2, 'item': ['b', 'c'], 'stock': [
+                {'_id': 10, 'sku': 'c'}, {'_id': 11, 'sku': ['a', 'b']}]},
+            {'_id': 3, 'stock': [{'_id': 13}]},
+        ]
+        lookup = {'$lookup': {
+            'from': 'items', 'localField': 'item', 'foreignField': 'sku', 'as': 'stock'}}
+        self.assertEqual(expected, list(self.db.orders.aggregate([lookup])))
+
+        # the documents are looked up in the index of the foreign field
+        self.db.items.create_index('sku')
+        self.assertEqual(expected, list(self.db.orders.aggregate([lookup])))
+
+        # the joined documents are copies
+        actual = list(self.db.orders.aggregate([lookup]))
+        actual[0]['stock'][1]['sku'] = 'z'
+        self.assertEqual('a', actual[1]['stock'][1]['sku'][0])
+        self.assertEqual({'_id': 12, 'sku': 'a'}, self.db.items.find_one({'_id': 12}))
+
+        with self.assertRaises(mongomock.OperationFailure):
+            self.db.orders.aggregate([{'$lookup': {'from': 'items', 'as': 'stock'}}])
+
+    def test__aggregate_lookup_pipeline(self):
+        self.db.orders.insert_many([{'_id': 1, 'item': 'a'}, {'_id': 2, 'item': 'b'}])
+        self.db.items.insert_many([
+            {'_id': 10, 'sku': 'a', 'qty': 1},
+            {'_id': 11, 'sku': 'b', 'qty': 2},
+            {'_id': 12, 'sku': 'a', 'qty': 3},
+        ])
+        actual = self.db.orders.aggregate([{'$lookup': {
+            'from': 'items',
+            'pipeline': [{'$match': {'qty': {'$gt': 1}}}, {'$project': {'_id': 1}}],
+            'as': 'stock',
+        }}])
+        self.assertEqual([
+            {'_id': 1, 'item': 'a', 'stock': [{'_id': 11}, {'_id': 12}]},
+            {'_id': 2, 'item': 'b', 'stock': [{'_id': 11}, {'_id': 12}]},
+        ], list(actual))
+
+        actual = self.db.orders.aggregate([{'$lookup': {
+            'from': 'items',
+            'let': {'item': '$item'},
+            'pipeline': [
+                {'$match': {'$expr': {'$eq': ['$$item', '$sku']}}},
+                {'$match': {'qty': {'$gt': 1}}},
+                {'$project': {'_id': 1}},
+            ],
+            'as': 'stock',
+        }}])
+        self.assertEqual([
+            {'_id': 1, 'item': 'a', 'stock': [{'_id': 12}]},
+            {'_id': 2, 'item': 'b', 'stock': [{'_id': 11}]},
+        ], list(actual))
+
+        with self.assertRaises(NotImplementedError):
+            self.db.orders.aggregate([{'$lookup': {
+                'from': 'items',
+                'let': {'item': '$item'},
+                'pipeline': [{'$match': {'$expr': {'$gt': ['$qty', '$$item']}}}],
+                'as': 'stock',
+            }}])
+
     def test__all_elemmatch(self):
         self.db.collection.insert([
             {
@@ -1303,6 +2065,37 @@ class CollectionAPITest(TestCase):
             ])
         self.assertEqual(str(cm.exception), 'batch op errors occurred')
 
+    def test_insert_many_bulk_write_error_details(self):
+        collection = self.db.collection
+        collection.create_index('a', unique=True)
+        collection.insert_one({'_id': 1, 'a': 1})
+        with self.assertRaises(mongomock.BulkWriteError) as cm:
+            collection.insert_many([{'_id': 2, 'a': 2}, {'_id': 1}, {'_id': 3, 'a': 3}])
+        details = cm.exception.details
+        self.assertEqual(1, details['nInserted'])
+        self.assertEqual([(1, 11000)], [
+            (error['index'], error['code']) for error in details['writeErrors']])
+        self.assertEqual({'_id': 1}, details['writeErrors'][0]['op'])
+        self.assertEqual([1, 2], sorted(doc['_id'] for doc in collection.find()))
+
+        with self.assertRaises(mongomock.BulkWriteError) as cm:
+            collection.insert_many([
+                {'_id': 3, 'a': 3},
+                {'_id': 1},
+                {'_id': 4, 'a': 3},
+                {'_id': 5, 'a': 5},
+                {'_id': 5, 'a': 6},
+            ], ordered=False)
+        details = cm.exception.details
+        self.assertEqual(2, details['nInserted'])
+        self.assertEqual([1, 2, 4], [error['index'] for error in details['writeErrors']])
+        self.assertIn('index: a_1', details['writeErrors'][1]['errmsg'])
+        self.assertEqual([1, 2, 3, 5], sorted(doc['_id'] for doc in collection.find()))
+
+        result = collection.insert_many(
+            (doc for doc in [{'_id': 6, 'a': 6}, {'_id': 7, 'a': 7}]), ordered=False)
+        self.assertEqual([6, 7], result.inserted_ids)
+
     @skipIf(not _HAVE_PYMONGO, "pymongo not installed")
     def test_insert_bson_validation(self):
         collection = self.db.collection
@@ -1323,6 +2116,38 @@ class CollectionAPITest(TestCase):
             collection.insert({"$foo": "bar"})
         self.assertEqual(str(cm.exception), "key '$foo' must not start with '$'")
 
+    def test_insert_lightweight_bson_validation(self):
+        collection = mongomock.MongoClient(validate_bson='lightweight').db.collection
+        with self.assertRaises(mongomock.InvalidDocument) as cm:
+            collection.insert_one({'a': [{'b': {'c'}}]})
+        self.assertTrue(str(cm.exception).startswith('Cannot encode object: '))
+        with self.assertRaises(mongomock.InvalidDocument) as cm:
+            collection.insert_one({'a': {'$foo': 'bar'}})
+        self.assertEqual("key '$foo' must not start with '$'", str(cm.exception))
+        with self.assertRaises(mongomock.InvalidDocument) as cm:
+            collection.insert_one({'a': {'b.c': 'bar'}})
+        self.assertEqual("key 'b.c' must not contain '.'", str(cm.exception))
+        with self.assertRaises(mongomock.InvalidDocument):
+            collection.insert_one({'a': {1: 'bar'}})
+        with self.assertRaises(OverflowError):
+            collection.insert_one({'a': 2 ** 64})
+        with self.assertRaises(ValueError):
+            collection.insert_one({1: 'bar'})
+        self.assertEqual(0, collection.count())
+
+        collection.insert_one({
+            'a': [1, 2.5, 'c', None, True, {'d': datetime.now()}],
+            'e': (mongomock.ObjectId(), uuid.uuid4()),
+        })
+        self.assertEqual(1, collection.count())
+
+    def test_insert_without_bson_validation(self):
+        collection = mongomock.MongoClient(validate_bson='off').db.collection
+        collection.insert_one({'a': {'$b': 1}})
+        self.assertEqual({'$b': 1}, collection.find_one()['a'])
+        with self.assertRaises(mongomock.ConfigurationError):
+            mongomock.MongoClient(validate_bson='partial')
+
     def test_aggregate_unwind_push_first(self):
         collection = self.db.collection
         collection.insert_many(
@@ -1406,3 +2231,51 @@ class CollectionAPITest(TestCase):
                 '_id': 'ooo'
             }]
         self.assertEqual(expect, list(actual))
+
+
+class FrozenDocumentsCollectionAPITest(CollectionAPITest):
+
+    def setUp(self):
+        super(FrozenDocumentsCollectionAPITest, self).setUp()
+        self.client = mongomock.MongoClient(frozen_documents=True)
+        self.db = self.client['somedb']
+
+    def test__stored_documents_are_immutable(self):
+        self.db.collection.insert_one({'_id': 1, 'a': {'b': [1, 2]}})
+        stored = self.db.collection._documents[1]
+        with self.assertRaises(TypeError):
+            stored['c'] = 1
+        with self.assertRaises(TypeError):
+            stored['a']['b'].append(3)
+
+    def test__read_documents_are_copy_on_write(self):
+        original = {'_id': 1, 'a': {'b': [1, {'c': 2}]}, 'd': 'e'}
+        self.db.collection.insert_one(copy.deepcopy(original))
+
+        doc = self.db.collection.find_one()
+        self.assertEqual(original, doc)
+        doc['a']['b'][1]['c'] = 3
+        doc['a']['b'].append(4)
+        doc['d'] = 'f'
+        for item in doc['a']['b']:
+            if isinstance(item, dict):
+                item['g'] = 5
+        self.assertEqual({'_id': 1, 'a': {'b': [1, {'c': 3, 'g': 5}, 4]}, 'd': 'f'}, doc)
+        self.assertEqual(original, self.db.collection.find_one())
+        self.assertEqual(original, copy.deepcopy(self.db.collection.find_one()))
+
+        self.db.collection.update_one({'_id': 1}, {'$push': {'a.b': 6}})
+        self.assertEqual([1, {'c': 2}, 6], self.db.collection.find_one()['a']['b'])
+
+    def test__read_documents_copied_as_dicts_are_copy_on_write(self):
+        self.db.collection.insert_one({'_id': 1, 'a': {'b': [{'c': 2}]}})
+        updated = {}
+        updated.update(self.db.collection.find_one())
+        for doc in (dict(self.db.collection.find_one()),
+                    dict(**self.db.collection.find_one()),
+                    updated):
+            doc['a']['b'][0]['c'] = 3
+            doc['a']['d'] = dict(doc['a'])
+            doc['a']['d']['b'].append(4)
+            self.assertEqual({'c': 3}, doc['a']['b'][0])
+        self.assertEqual({'_id': 1, 'a': {'b': [{'c': 2}]}}, self.db.collection.find_one())
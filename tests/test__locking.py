@@ -0,0 +1,106 @@
+import threading
+from unittest import TestCase
+
+import mongomock
+from mongomock.locking import RWLock
+
+
+class RWLockTest(TestCase):
+
+    def setUp(self):
+        super(RWLockTest, self).setUp()
+        self.lock = RWLock()
+
+    def _try_acquire(self, acquire, release):
+        done = threading.Event()
+
+        def target():
+            acquire()
+            done.set()
+            release()
+        thread = threading.Thread(target=target)
+        thread.daemon = True
+        thread.start()
+        return done.wait(.2)
+
+    def test__readers_share_the_lock(self):
+        with self.lock.reader:
+            self.assertTrue(self._try_acquire(self.lock.acquire_read, self.lock.release_read))
+            self.assertFalse(self._try_acquire(self.lock.acquire_write, self.lock.release_write))
+
+    def test__writer_holds_the_lock_alone(self):
+        with self.lock.writer:
+            self.assertFalse(self._try_acquire(self.lock.acquire_read, self.lock.release_read))
+        # the blocked reader got the lock once it was released
+        self.assertTrue(self._try_acquire(self.lock.acquire_write, self.lock.release_write))
+
+    def test__reentrant(self):
+        with self.lock.writer:
+            with self.lock.writer:
+                with self.lock.reader:
+                    pass
+            self.assertFalse(self._try_acquire(self.lock.acquire_read, self.lock.release_read))
+        with self.lock.reader:
+            with self.lock.reader:
+                pass
+            self.assertFalse(self._try_acquire(self.lock.acquire_write, self.lock.release_write))
+        self.assertTrue(self._try_acquire(self.lock.acquire_write, self.lock.release_write))
+
+    def test__readers_cannot_upgrade(self):
+        reading = [threading.Event(), threading.Event()]
+        errors = []
+
+        def target(number):
+            with self.lock.reader:
+                reading[number].set()
+                reading[1 - number].wait(1)
+                try:
+                    self.lock.acquire_write()
+                except RuntimeError as error:
+                    errors.append(error)
+                else:
+                    self.lock.release_write()
+
+        threads = [threading.Thread(target=target, args=(number,)) for number in range(2)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join(1)
+            self.assertFalse(thread.is_alive())
+        self.assertEqual(2, len(errors))
+        # the lock is left free
+        self.assertTrue(self._try_acquire(self.lock.acquire_write, self.lock.release_write))
+
+
+class CollectionThreadsTest(TestCase):
+
+    def test__concurrent_writes(self):
+        collection = mongomock.MongoClient().db.collection
+        collection.create_index('value')
+        collection.insert_one({'_id': 'counter', 'value': 0})
+
+        errors = []
+
+        def target(thread_number):
+            try:
+                for i in range(50):
+                    collection.insert_one({'thread': thread_number, 'value': i})
+                    collection.update_one({'_id': 'counter'}, {'$inc': {'value': 1}})
+                    collection.delete_one({'thread': thread_number, 'value': i // 2})
+                    list(collection.find({'thread': thread_number}).sort('value'))
+            except Exception as error:
+                errors.append(error)
+
+        threads = [threading.Thread(target=target, args=(n,)) for n in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual([], errors)
+        self.assertEqual(200, collection.find_one({'_id': 'counter'})['value'])
+        self.assertEqual(101, collection.count())
+        self.assertEqual(
+            sorted(list(range(25, 50)) * 4),
+            sorted(doc['value'] for doc in collection.find({'thread': {'$exists': True}})))
@@ -0,0 +1,49 @@
+import copy
+import datetime
+import pickle
+from unittest import TestCase
+
+from mongomock.object_id import InvalidId
+from mongomock.object_id import ObjectId
+
+
+class ObjectIdTest(TestCase):
+
+    def test__new_ids_are_sorted(self):
+        ids = [ObjectId() for _ in range(1000)]
+        self.assertEqual(1000, len(set(ids)))
+        self.assertEqual(12, len(ids[0].binary))
+        # same process, same second: only the counter differs (it may wrap once)
+        self.assertEqual(ids[0].binary[4:9], ids[-1].binary[4:9])
+        self.assertLessEqual(
+            sum(1 for previous, oid in zip(ids, ids[1:]) if not previous < oid), 1)
+
+    def test__from_string(self):
+        oid = ObjectId('52d669dcad547f059424f783')
+        self.assertEqual('52d669dcad547f059424f783', str(oid))
+        self.assertEqual("ObjectId('52d669dcad547f059424f783')", repr(oid))
+        self.assertEqual(oid, ObjectId(u'52d669dcad547f059424f783'))
+        self.assertEqual(oid, ObjectId(oid))
+        self.assertEqual(oid, ObjectId(oid.binary))
+        self.assertEqual(hash(oid), hash(ObjectId(str(oid))))
+        self.assertNotEqual(oid, str(oid))
+        self.assertTrue(ObjectId.is_valid('52d669dcad547f059424f783'))
+        self.assertFalse(ObjectId.is_valid('52d669dcad547f059424f78'))
+        self.assertFalse(ObjectId.is_valid(None))
+        with self.assertRaises(InvalidId):
+            ObjectId('52d669dcad547f059424f78z')
+        with self.assertRaises(TypeError):
+            ObjectId(12)
+
+    def test__generation_time(self):
+        when = datetime.datetime(2017, 3, 4, 5, 6, 7)
+        oid = ObjectId.from_datetime(when)
+        self.assertEqual(when, oid.generation_time.replace(tzinfo=None))
+        self.assertEqual(datetime.timedelta(0), oid.generation_time.utcoffset())
+        self.assertLess(oid, ObjectId())
+        self.assertLess(ObjectId.from_datetime(when - datetime.timedelta(seconds=1)), oid)
+
+    def test__copy(self):
+        oid = ObjectId()
+        self.assertEqual(oid, copy.deepcopy(oid))
+        self.assertEqual(oid, pickle.loads(pickle.dumps(oid)))